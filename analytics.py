@@ -0,0 +1,582 @@
+"""Precomputed tables of an uploaded Weebly store.
+
+A StoreDataset is built once per upload from the line items of the export:
+
+  items     - one row per line item (order #, date, product, quantity, sales)
+  orders    - one row per order with the order-level fields, which Weebly only
+              fills in on the first line item of every order
+  customers - one row per customer (shipping email) with their details and
+              guessed gender, indexed by the integer customer code that the
+              orders table refers to
+
+and daily cubes that the charts are reduced from, so that switching between
+daily/weekly/monthly views costs O(days), not O(items):
+
+  days              - one row per day: sales, shipping, # of orders, # of
+                      orders with a coupon
+  product_days      - one row per day x product: sales and quantity
+  zip_days          - one row per day x shipping zip code/city: subtotal
+  zip_product_days  - one row per day x zip code/city x product: sales
+
+Cumulative sums over both cubes (see PrefixSums) answer "totals between two
+dates" for every product in constant time per product.
+
+Chart builders read from these tables instead of re-deriving orders and
+customers from the line items with their own drop_duplicates/groupby.
+
+A newer export can be merged into a dataset (see append): only the new
+orders are parsed and aggregated, and only the days they touch are replaced
+in the daily cubes.
+
+All tables except customers are kept sorted by date, so restricting a
+dataset to a date range is a binary search and a slice (see between) rather
+than a full boolean mask and copy.
+
+This module doesn't depend on Dash or Plotly. Everything the dashboard shows
+is computed by the StoreDataset methods below (sales_series, order_series,
+product_revenue, zip_sales, spend_distribution, top_customers, ...), which
+return small pandas/NumPy results; app.py only turns them into figures. They
+can be used as is from scripts, batch jobs and benchmarks.
+"""
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from binning import bin_counts, shared_edges
+from genders import infer_genders
+from geocode import zip_coordinates
+from metrics import timed
+from schema import as_dollars
+
+ITEM_COLUMNS = ['Order #', 'Date', 'Product Name', 'Product Quantity',
+                'Sales ($)']
+ORDER_COLUMNS = ['Order #', 'Date', 'Subtotal', 'Shipping Price', 'Coupon',
+                 'Shipping Postal Code', 'Shipping City', 'Shipping Email']
+CUSTOMER_COLUMNS = ['Shipping Email', 'Shipping First Name',
+                    'Shipping Last Name', 'Shipping City', 'Shipping Region',
+                    'Shipping Postal Code']
+# Windows of the All/1m/3m/1yr views, ending today (see recent)
+RECENT_WINDOWS = [('1m', pd.Timedelta(days=30)),
+                  ('3m', pd.Timedelta(weeks=13)),
+                  ('1yr', pd.Timedelta(weeks=52))]
+
+
+# Output: function giving the # of rows of the table name of the dataset a
+#         method is called on: the rows its 'aggregate' stage goes through
+#         (see metrics.py). Methods answering from the prefix sums or from
+#         other timed methods record no rows of their own.
+def rows_of(name):
+    return lambda ds, *args, **kwargs: len(getattr(ds, name))
+
+
+class StoreDataset(object):
+
+    # Input:  tables: dict of date-sorted dataframes (items, orders, days,
+    #                 ...), each becomes an attribute of the dataset
+    #         customers: customers table, shared by all date windows
+    #         prefix: PrefixSums of the full dataset
+    #         start, end: date bounds of the window, None if unbounded
+    def __init__(self, tables, customers, prefix, start=None, end=None):
+        self.tables = tables
+        for name, table in tables.items():
+            setattr(self, name, table)
+        self.customers = customers
+        self.prefix = prefix
+        self.start = start
+        self.end = end
+
+    # Output: StoreDataset with orders/customers tables derived from the items
+    # Input:  items: dataframe of line items (see ingest.read_orders)
+    @classmethod
+    @timed('aggregate', rows=lambda cls, items: len(items))
+    def from_items(cls, items):
+        items = items.sort_values('Date', kind='mergesort').reset_index(drop=True)
+        first_lines = items.drop_duplicates(subset='Order #')
+
+        orders = first_lines[ORDER_COLUMNS].reset_index(drop=True)
+        orders['Subtotal'] = orders['Subtotal'].fillna(0)
+        orders['Shipping Price'] = orders['Shipping Price'].fillna(0)
+        orders['Total'] = as_dollars(orders['Subtotal']) + \
+                          as_dollars(orders['Shipping Price'])
+        # customer code = code of the email category, -1 if unknown
+        orders['Customer'] = orders['Shipping Email'].cat.codes.astype(np.int32)
+        del orders['Shipping Email']
+
+        # customer details as of their latest order
+        customers = first_lines.drop_duplicates(subset='Shipping Email',
+                                                keep='last')
+        customers = customers.loc[customers['Shipping Email'].notnull(),
+                                  CUSTOMER_COLUMNS]
+        customers.index = customers['Shipping Email'].cat.codes.values
+        customers = customers.reindex(
+            np.arange(len(items['Shipping Email'].cat.categories)))
+        customers['Gender'] = infer_genders(customers['Shipping First Name'])
+
+        tables = OrderedDict()
+        tables['items'] = items[ITEM_COLUMNS]
+        tables['orders'] = orders
+        tables['days'] = daily_totals(orders)
+        tables['product_days'] = daily_product_totals(tables['items'])
+        tables['zip_days'], tables['zip_product_days'] = \
+            daily_zip_totals(tables['items'], orders)
+        return cls(tables, customers,
+                   PrefixSums(tables['days'], tables['product_days']))
+
+    # Output: StoreDataset with the line items of a newer export merged in.
+    #         An order in the new export replaces every stored line of the
+    #         same Order # (so overlapping exports are deduplicated on
+    #         Order # and line), and only the days of the new and replaced
+    #         orders are re-aggregated.
+    # Input:  items: dataframe of line items (see ingest.read_orders)
+    @timed('aggregate', rows=rows_of('items'))
+    def append(self, items):
+        new = StoreDataset.from_items(items)
+        replaced = self.orders['Order #'].isin(new.orders['Order #']).values
+        affected = pd.DatetimeIndex(np.union1d(new.days['Date'].values,
+                                               self.orders['Date'].values[replaced]))
+
+        # customer codes are codes of the email categories, which grow
+        emails = self.customers['Shipping Email'].cat.categories.union(
+            new.customers['Shipping Email'].cat.categories)
+        old_codes = emails.get_indexer(self.customers['Shipping Email'].cat.categories)
+        new_codes = emails.get_indexer(new.customers['Shipping Email'].cat.categories)
+
+        customers = self.customers.copy()
+        customers.index = old_codes
+        updated = new.customers.loc[new.customers['Shipping Email'].notnull()].copy()
+        updated.index = new_codes[updated.index]
+        kept = customers.loc[~customers.index.isin(updated.index)]
+        customers = concat_tables([kept, updated])
+        customers.index = np.concatenate([kept.index.values, updated.index.values])
+        customers = customers.reindex(np.arange(len(emails)))
+
+        old_orders = self.orders.loc[~replaced].copy()
+        old_orders['Customer'] = recode(old_orders['Customer'].values, old_codes)
+        new_orders = new.orders.copy()
+        new_orders['Customer'] = recode(new_orders['Customer'].values, new_codes)
+        orders = sort_by_date(concat_tables([old_orders, new_orders]))
+
+        kept_items = ~self.items['Order #'].isin(new.orders['Order #']).values
+        items = sort_by_date(concat_tables([self.items.loc[kept_items], new.items]))
+
+        # re-aggregate the affected days only
+        items_affected = items.loc[items['Date'].isin(affected).values]
+        orders_affected = orders.loc[orders['Date'].isin(affected).values]
+        fresh = {'days': daily_totals(orders_affected),
+                 'product_days': daily_product_totals(items_affected)}
+        fresh['zip_days'], fresh['zip_product_days'] = \
+            daily_zip_totals(items_affected, orders_affected)
+
+        tables = OrderedDict()
+        tables['items'] = items
+        tables['orders'] = orders
+        for name in ['days', 'product_days', 'zip_days', 'zip_product_days']:
+            table = getattr(self, name)
+            kept = table.loc[~table['Date'].isin(affected).values]
+            tables[name] = sort_by_date(concat_tables([kept, fresh[name]]))
+        return StoreDataset(tables, customers,
+                            PrefixSums(tables['days'], tables['product_days']))
+
+    # Output: StoreDataset restricted to orders placed between the dates,
+    #         its tables are slices (views) of this dataset's tables
+    # Input:  start, end: inclusive bounds (datetime or date string)
+    @timed('filter')
+    def between(self, start, end):
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if self.start is not None:
+            start = max(start, self.start)
+        if self.end is not None:
+            end = min(end, self.end)
+        tables = OrderedDict((name, date_slice(table, start, end))
+                             for name, table in self.tables.items())
+        return StoreDataset(tables, self.customers, self.prefix, start, end)
+
+    # Output: dict of the window's sales ('Total'), 'Shipping Price',
+    #         # of 'Orders' and # of 'Promo' orders
+    @timed('aggregate')
+    def totals(self):
+        return self.prefix.totals(self.start, self.end)
+
+    # Output: dataframe of 'Product Name', 'Product Quantity' and 'Sales ($)'
+    #         of every product sold in the window
+    @timed('aggregate')
+    def product_totals(self):
+        return self.prefix.product_totals(self.start, self.end)
+
+    # Output: long-form dataframe of 'Date' (period label), 'Product Name'
+    #         and 'Sales ($)', one row per period and product with sales.
+    #         Only the top_n best selling products of the window are kept,
+    #         the others are summed into 'Other', and shipping is added as
+    #         'Shipping'. 'Product Name' is categorical in that order.
+    #         Products named like one of these two are summed into 'Other'.
+    # Input:  scale: 'D', 'W' or 'M' for daily, weekly or monthly periods
+    #         top_n: number of products shown on their own
+    @timed('aggregate', rows=rows_of('product_days'))
+    def product_sales(self, scale, top_n=15):
+        totals = self.product_totals().sort_values('Sales ($)', ascending=False,
+                                                   kind='mergesort')
+        ranked = totals['Product Name'].astype(str)
+        top = list(ranked[~ranked.isin(['Other', 'Shipping'])][:top_n])
+        names = self.product_days['Product Name']
+        products = names.cat.categories.astype(str)
+        buckets = np.where(products.isin(top), products, 'Other')
+        categories = top + ['Other', 'Shipping']
+
+        sales = pd.DataFrame({
+            'Date': period_labels(self.product_days['Date'], scale),
+            'Product Name': pd.Categorical(buckets[names.cat.codes.values],
+                                           categories=categories),
+            'Sales ($)': self.product_days['Sales ($)'].values})
+        shipping = pd.DataFrame({
+            'Date': period_labels(self.days['Date'], scale),
+            'Product Name': pd.Categorical(['Shipping'] * len(self.days),
+                                           categories=categories),
+            'Sales ($)': self.days['Shipping Price'].values})
+        return pd.concat([sales, shipping]).groupby(
+            ['Date', 'Product Name'], as_index=False, observed=True)['Sales ($)'].sum()
+
+    # Output: dataframe of the customers who ordered in this dataset with
+    #         their details, # of orders, subtotal, total spending and the
+    #         date of their last order
+    @timed('aggregate', rows=rows_of('orders'))
+    def customer_stats(self):
+        codes = self.orders['Customer'].values
+        known = codes >= 0
+        codes = codes[known]
+        n = len(self.customers)
+
+        count = np.bincount(codes, minlength=n)
+        subtotal = np.bincount(codes, minlength=n,
+                               weights=as_dollars(self.orders['Subtotal'].values[known]))
+        total = np.bincount(codes, minlength=n,
+                            weights=self.orders['Total'].values[known])
+        last = np.full(n, -1, dtype=np.int64)  # position of the last order
+        np.maximum.at(last, codes, np.flatnonzero(known))
+
+        active = count > 0
+        stats = self.customers.loc[active].copy()
+        stats['Orders'] = count[active]
+        stats['Subtotal'] = subtotal[active]
+        stats['Total Sales ($)'] = total[active]
+        stats['Last Purchase'] = self.orders['Date'].values[last[active]]
+        return stats
+
+    # Output: OrderedDict of 'All' (this dataset) and the RECENT_WINDOWS
+    #         names -> StoreDataset of that window, ending today
+    # Input:  today: end of the windows (default: the current date)
+    def recent(self, today=None):
+        today = pd.Timestamp(today if today is not None else datetime.date.today())
+        today = today.normalize()
+        windows = OrderedDict([('All', self)])
+        for name, length in RECENT_WINDOWS:
+            windows[name] = self.between(today - length, today)
+        return windows
+
+    # Output: dataframe of 'Date' (period label, see resample_days) and
+    #         the 'Sales ($)' of every period, including empty periods
+    # Input:  scale: 'D', 'W' or 'M' for daily, weekly or monthly periods
+    @timed('aggregate', rows=rows_of('days'))
+    def sales_series(self, scale):
+        sales = self.days[['Date', 'Total']].rename(columns={'Total': 'Sales ($)'})
+        return resample_days(sales, scale)
+
+    # Output: dataframe of 'Date' (period label, see resample_days) and the
+    #         # of orders of every period: 'Total', 'Promo' (with a coupon)
+    #         and 'Regular' (without)
+    # Input:  scale: 'D', 'W' or 'M' for daily, weekly or monthly periods
+    @timed('aggregate', rows=rows_of('days'))
+    def order_series(self, scale):
+        orders = self.days[['Date', 'Orders', 'Promo']].rename(columns={'Orders': 'Total'})
+        orders['Regular'] = orders['Total'] - orders['Promo']
+        return resample_days(orders, scale)
+
+    # Output: dataframe of 'Product Name', 'Product Quantity', 'Sales ($)'
+    #         and '% of Total Sales' of every product sold plus 'Shipping'
+    #         (quantity = # of orders), by decreasing sales, and a last
+    #         'Total' row
+    @timed('aggregate')
+    def product_revenue(self):
+        totals = self.totals()
+        prods = self.product_totals()
+        prods['Product Name'] = prods['Product Name'].astype(str)
+        ship = pd.DataFrame([['Shipping', totals['Orders'], totals['Shipping Price']]],
+                            columns=['Product Name', 'Product Quantity', 'Sales ($)'])
+        prods = pd.concat([prods, ship], ignore_index=True)
+        prods['% of Total Sales'] = prods['Sales ($)'] / prods['Sales ($)'].sum() * 100
+        prods = prods.sort_values(by='Sales ($)', ascending=False)
+
+        total = pd.DataFrame([['Total', prods['Product Quantity'].sum(),
+                                prods['Sales ($)'].sum(), prods['% of Total Sales'].sum()]],
+                             columns=prods.columns)
+        return pd.concat([prods, total], ignore_index=True)
+
+    # Output: dataframe of 'Shipping Postal Code', 'Shipping City', the
+    #         'Subtotal' of the orders shipped there and its 'lat'/'long'
+    @timed('aggregate', rows=rows_of('zip_days'))
+    def zip_sales(self):
+        zips = self.zip_days.groupby(['Shipping Postal Code', 'Shipping City'],
+                                     as_index=False, observed=True)['Subtotal'].sum()
+        zips['lat'], zips['long'] = zip_coordinates(zips['Shipping Postal Code'])
+        return zips
+
+    # Output: same as zip_sales with one row per zip code/city x 'Product Name'
+    #         and the 'Sales ($)' of the product
+    @timed('aggregate', rows=rows_of('zip_product_days'))
+    def zip_product_sales(self):
+        zips = self.zip_product_days.groupby(
+            ['Shipping Postal Code', 'Shipping City', 'Product Name'],
+            as_index=False, observed=True)['Sales ($)'].sum()
+        zips['lat'], zips['long'] = zip_coordinates(zips['Shipping Postal Code'])
+        return zips
+
+    # Output: edges: bin edges shared by the windows (see binning.py)
+    #         counts: OrderedDict of window name (see recent) -> # of orders
+    #                 per bin of dollars spent (sales + shipping)
+    # Input:  today: end of the windows (default: the current date)
+    @timed('aggregate', rows=rows_of('orders'))
+    def spend_distribution(self, today=None):
+        return histograms(OrderedDict(
+            (name, window.orders['Total']) for name, window in self.recent(today).items()))
+
+    # Output: edges: bin edges (whole numbers) shared by the windows
+    #         counts: OrderedDict of window name (see recent) -> # of
+    #                 customers per bin of # of orders
+    # Input:  today: end of the windows (default: the current date)
+    @timed('aggregate')
+    def order_count_distribution(self, today=None):
+        return histograms(OrderedDict(
+            (name, window.customer_stats()['Orders'])
+            for name, window in self.recent(today).items()), integer=True)
+
+    # Output: edges: bin edges of lifetime spending
+    #         counts: # of customers per bin
+    @timed('aggregate')
+    def lifetime_distribution(self):
+        edges, counts = histograms({'All': self.customer_stats()['Total Sales ($)']})
+        return edges, counts['All']
+
+    # Output: page: dataframe of customer_stats rows k = offset..offset+limit
+    #               when sorted by column
+    #         n_customers: Int which is the # of customers in the dataset
+    # Input:  offset, limit: position and size of the page
+    #         column: customer_stats column to sort by
+    #         ascending: sort order
+    @timed('aggregate')
+    def top_customers(self, offset, limit, column='Subtotal', ascending=False):
+        stats = self.customer_stats()
+        k = offset + limit  # only the rows up to the end of the page get sorted
+        if stats[column].dtype.kind in 'biufM':
+            top = top_k(stats, column, k, ascending=ascending)
+        else: # text columns
+            top = stats.sort_values(by=column, ascending=ascending,
+                                    kind='mergesort').iloc[:k]
+        return top.iloc[offset:], len(stats)
+
+    # Output: Float which is the % of customers with a (mostly) female first
+    #         name among the customers with a name guess ('andy' excluded)
+    @timed('aggregate')
+    def female_share(self):
+        genders = self.customer_stats()['Gender'].value_counts()
+        female = genders.get('female', 0) + genders.get('mostly_female', 0)
+        male = genders.get('male', 0) + genders.get('mostly_male', 0)
+        known = female + male + genders.get('unknown', 0)
+        return female / known * 100 if known else 0
+
+
+class PrefixSums(object):
+
+    DAY_COLUMNS = ['Total', 'Shipping Price', 'Orders', 'Promo']
+
+    # Input:  days: daily_totals() of a dataset
+    #         product_days: daily_product_totals() of the same dataset
+    def __init__(self, days, product_days):
+        self.dates = days['Date'].values
+        n_days = len(self.dates)
+
+        # row i holds the totals of all days before self.dates[i]
+        self.day_sums = np.zeros((n_days + 1, len(self.DAY_COLUMNS)))
+        np.cumsum(days[self.DAY_COLUMNS].values, axis=0, out=self.day_sums[1:])
+
+        self.products = product_days['Product Name'].cat.categories
+        rows = self.dates.searchsorted(product_days['Date'].values) + 1
+        cols = product_days['Product Name'].cat.codes.values
+        self.sales_sums = np.zeros((n_days + 1, len(self.products)))
+        self.sales_sums[rows, cols] = product_days['Sales ($)'].values
+        self.quantity_sums = np.zeros((n_days + 1, len(self.products)), dtype=np.int64)
+        self.quantity_sums[rows, cols] = product_days['Product Quantity'].values
+        np.cumsum(self.sales_sums, axis=0, out=self.sales_sums)
+        np.cumsum(self.quantity_sums, axis=0, out=self.quantity_sums)
+
+    # Output: (lo, hi) rows of the prefix sums bounding the window
+    # Input:  start, end: inclusive bounds, None for unbounded
+    def rows(self, start=None, end=None):
+        lo, hi = 0, len(self.dates)
+        if start is not None:
+            lo = self.dates.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+        if end is not None:
+            hi = self.dates.searchsorted(pd.Timestamp(end).to_datetime64(), side='right')
+        return lo, max(lo, hi)
+
+    # Output: dict of day-level totals between the dates (see DAY_COLUMNS)
+    # Input:  start, end: inclusive bounds, None for unbounded
+    def totals(self, start=None, end=None):
+        lo, hi = self.rows(start, end)
+        sums = self.day_sums[hi] - self.day_sums[lo]
+        totals = dict(zip(self.DAY_COLUMNS, sums))
+        totals['Orders'] = int(round(totals['Orders']))
+        totals['Promo'] = int(round(totals['Promo']))
+        return totals
+
+    # Output: dataframe of 'Product Name', 'Product Quantity' and 'Sales ($)'
+    #         of the products sold between the dates
+    # Input:  start, end: inclusive bounds, None for unbounded
+    def product_totals(self, start=None, end=None):
+        lo, hi = self.rows(start, end)
+        quantity = self.quantity_sums[hi] - self.quantity_sums[lo]
+        sales = self.sales_sums[hi] - self.sales_sums[lo]
+        sold = (quantity != 0) | (np.round(sales, 2) != 0)
+        return pd.DataFrame({'Product Name': self.products[sold],
+                             'Product Quantity': quantity[sold],
+                             'Sales ($)': sales[sold]},
+                            columns=['Product Name', 'Product Quantity', 'Sales ($)'])
+
+
+# Output: dataframe with one row per day (sorted) and the day's sales
+#         ('Total'), 'Shipping Price', # of 'Orders' and # of 'Promo' orders
+# Input:  orders: orders table of a StoreDataset
+def daily_totals(orders):
+    by_day = orders.groupby('Date')
+    days = by_day[['Total']].sum()
+    days['Shipping Price'] = as_dollars(by_day['Shipping Price'].sum())
+    days['Orders'] = by_day.size()
+    days['Promo'] = by_day['Coupon'].count()
+    return days.reset_index()
+
+
+# Output: dataframe with one row per (day, product), sorted by day, with the
+#         'Sales ($)' and 'Product Quantity' of the product that day
+# Input:  items: line items table of a StoreDataset
+def daily_product_totals(items):
+    product_days = items.groupby(['Date', 'Product Name'], as_index=False,
+                                 observed=True)[['Sales ($)', 'Product Quantity']].sum()
+    product_days['Sales ($)'] = as_dollars(product_days['Sales ($)'])
+    return product_days
+
+
+# Output: zip_days: dataframe with one row per (day, zip code, city), sorted
+#                   by day, with the 'Subtotal' of the orders shipped there
+#         zip_product_days: same with one row per (day, zip, city, product)
+#                           and the 'Sales ($)' of the product
+# Input:  items, orders: line items and orders tables of a StoreDataset
+def daily_zip_totals(items, orders):
+    keys = ['Date', 'Shipping Postal Code', 'Shipping City']
+    shipped = orders.dropna(subset=['Shipping Postal Code'])
+    zip_days = shipped.groupby(keys, as_index=False, observed=True)['Subtotal'].sum()
+    zip_days['Subtotal'] = as_dollars(zip_days['Subtotal'])
+
+    item_zips = items[['Order #', 'Product Name', 'Sales ($)']].merge(
+        shipped[['Order #'] + keys], on='Order #')
+    zip_product_days = item_zips.groupby(keys + ['Product Name'], as_index=False,
+                                         observed=True)['Sales ($)'].sum()
+    zip_product_days['Sales ($)'] = as_dollars(zip_product_days['Sales ($)'])
+    return zip_days, zip_product_days
+
+
+# Output: edges: bin edges shared by all the series (see binning.py)
+#         counts: OrderedDict of name -> count of values per bin
+# Input:  series: dict of name -> values
+#         integer: True for integer counts (whole number bins)
+def histograms(series, integer=False):
+    edges = shared_edges(list(series.values()), integer=integer)
+    return edges, OrderedDict((name, bin_counts(values, edges))
+                              for name, values in series.items())
+
+
+# Output: dataframe of frame's columns summed per period, with a 'Date'
+#         column of period labels: 'YYYY-MM-DD' (day, or the Sunday ending
+#         the week) or 'YYYY-MM' (month). Periods without rows are zeros.
+# Input:  frame: daily table with a 'Date' column
+#         scale: 'D', 'W' or 'M'
+def resample_days(frame, scale):
+    resampled = frame.resample(scale, on='Date').sum()
+    resampled.index = resampled.index.strftime('%Y-%m' if scale == 'M' else '%Y-%m-%d')
+    resampled.index.name = 'Date'
+    return resampled.reset_index()
+
+
+# Output: array of period labels of the dates, as the charts' resampling
+#         labels them: 'YYYY-MM-DD' (day, or the Sunday ending the week) or
+#         'YYYY-MM' (month)
+# Input:  dates: series of dates (without time of day)
+#         scale: 'D', 'W' or 'M'
+def period_labels(dates, scale):
+    codes, days = pd.factorize(dates)  # label every distinct day once
+    days = pd.DatetimeIndex(days)
+    if scale == 'W':
+        days = days + pd.to_timedelta((6 - days.dayofweek) % 7, unit='D')
+    labels = days.strftime('%Y-%m' if scale == 'M' else '%Y-%m-%d')
+    return np.asarray(labels, dtype=object)[codes]
+
+
+# Output: the k first rows of frame when sorted by column, without sorting
+#         the whole frame (partial selection, then a sort of k rows). Ties
+#         keep the frame's order, so consecutive pages never overlap.
+# Input:  frame: dataframe
+#         column: name of a numeric or datetime column to sort by
+#         k: number of rows
+#         ascending: sort order
+def top_k(frame, column, k, ascending=False):
+    keys = frame[column].values
+    if keys.dtype.kind == 'M':
+        keys = keys.view(np.int64)
+    keys = keys if ascending else -keys
+    if k <= 0:
+        return frame.iloc[:0]
+    if k < len(keys):
+        kth = np.partition(keys, k - 1)[k - 1]
+        idx = np.flatnonzero(keys <= kth)
+    else:
+        idx = np.arange(len(keys))
+    idx = idx[np.argsort(keys[idx], kind='mergesort')][:k]
+    return frame.iloc[idx]
+
+
+# Output: dataframe of the frames' rows (new index), categorical columns
+#         with the union of their categories (sorted)
+# Input:  frames: list of dataframes with the same columns
+def concat_tables(frames):
+    categorical = [col for col in frames[0]
+                   if frames[0][col].dtype.name == 'category']
+    merged = {col: union_categoricals([f[col] for f in frames], sort_categories=True)
+              for col in categorical}
+    df = pd.concat([f.drop(columns=categorical) for f in frames],
+                   ignore_index=True, sort=False)
+    for col, values in merged.items():
+        df[col] = values
+    return df[frames[0].columns]
+
+
+# Output: frame stably sorted by its 'Date' column (new index)
+def sort_by_date(frame):
+    order = np.argsort(frame['Date'].values, kind='mergesort')
+    return frame.iloc[order].reset_index(drop=True)
+
+
+# Output: codes mapped through mapping, -1 (unknown) stays -1
+# Input:  codes: int array of category codes
+#         mapping: array of the new code of every old code
+def recode(codes, mapping):
+    return np.where(codes >= 0, mapping[codes], -1).astype(codes.dtype)
+
+
+# Output: rows of frame with start <= Date <= end, as a positional slice
+# Input:  frame: dataframe sorted by its 'Date' column
+#         start, end: inclusive bounds (datetime or date string)
+def date_slice(frame, start, end):
+    dates = frame['Date'].values
+    lo = dates.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+    hi = dates.searchsorted(pd.Timestamp(end).to_datetime64(), side='right')
+    return frame.iloc[lo:hi]
@@ -1,35 +1,80 @@
-import base64
-import io
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
 
 from datetime import datetime as dt
 from datetime import timedelta
-from uszipcode import SearchEngine
 
 
 import dateutil.parser
-import gender_guesser.detector as gender
 
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px 
 
+from datastore import DatasetStore, filter_fingerprint
+from figcache import FigureCache
+from metrics import REGISTRY, add_endpoints, instrument_callbacks, stage
+from parsecache import ParsedCache
+from sharedcache import backend_from_env
+from payload import pack_figure
+import jobs
+import warmup
+
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = dash.Dash(__name__, 
                 external_stylesheets=external_stylesheets)
 server = app.server
+# every callback is timed, numbers on /metrics (see metrics.py)
+instrument_callbacks(app)
+add_endpoints(server)
+# /ready: 503 until the first-use initializations are done (see warmup.py)
+warmup.add_ready_endpoint(server)
+
+# parsed datasets stay on the server, the browser only holds their IDs.
+# Both caches are shared by all gunicorn workers (see sharedcache.py)
+store = DatasetStore()
+# recently built figures, by filter fingerprint and view options
+figures = FigureCache(backend=backend_from_env('wea-figures'))
+# parsed uploads by content hash, so re-uploading a file skips parsing
+parsed = ParsedCache()
+
+# figure cache statistics for /metrics
+def collect_cache_metrics():
+    stats = figures.stats()
+    for result in ('hits', 'shared_hits', 'misses'):
+        REGISTRY.set('wea_figure_cache_total', (('result', result),), stats[result])
+    REGISTRY.set('wea_figure_cache_bytes', (), stats['bytes'])
+REGISTRY.add_collector(collect_cache_metrics)
+
+# Top customers table: displayed column -> customer_stats column
+SPENDERS_COLUMNS = [('First Name', 'Shipping First Name'),
+                    ('Last Name', 'Shipping Last Name'),
+                    ('Email', 'Shipping Email'),
+                    ('City', 'Shipping City'),
+                    ('State', 'Shipping Region'),
+                    ('Orders', 'Orders'),
+                    ('Last Purchase', 'Last Purchase'),
+                    ('Total Sales ($)', 'Total Sales ($)')]
+SPENDERS_PAGE_SIZE = 15
+
+# Products with their own color in the sales chart, the rest are 'Other'
+TOP_PRODUCTS = 15
 
 ### LAYOUT OF APP ##
 
 app.layout = html.Div(children=[
-   ## hidden div storing dataframes ##
+   ## hidden divs storing dataset ID / filter fingerprint ##
    html.Div(id='dataframe', style={'display':'none'}),
    html.Div(id='filtered-dataframe', style={'display':'none'}),
+   # filtered-dataframe as of the last time each tab was open
+   html.Div(id='sales-fingerprint', style={'display':'none'}),
+   html.Div(id='customer-fingerprint', style={'display':'none'}),
    #html.Div(id='filtered-dataframe'),
 
    #UPLOAD COMPONENT
@@ -56,8 +101,20 @@ app.layout = html.Div(children=[
             'background-color': 'white'
         },
     ),
+    dcc.Checklist(
+        id='append-checkbox',
+        options=[
+                {'label':'Add a newer export to the uploaded data','value':'y'}
+        ],
+        value=[],
+        style={'textAlign':'center', 'font-size': '16px'}
+    ),
     html.P(id='filename',
            style={'textAlign':'center', 'font-style':'italic'}),
+    # ID of the background job ingesting the upload (see jobs.py), and
+    # the timer polling its progress while it runs
+    dcc.Store(id='upload-job'),
+    dcc.Interval(id='upload-poll', interval=500, disabled=True),
     html.Hr()
    ], 
    style={'background-color':'rgba(220,220,220,0.3)',
@@ -113,9 +170,9 @@ app.layout = html.Div(children=[
                
    html.Br(),
    
-   dcc.Tabs(id='tabs', children=[
+   dcc.Tabs(id='tabs', value='sales', children=[
            ## Tab 1 (Sales) ##
-           dcc.Tab(id='sales-tab', label='Sales', children=[
+           dcc.Tab(id='sales-tab', label='Sales', value='sales', children=[
                 html.Br(),
                 # Top controls
                 html.Div([
@@ -179,6 +236,8 @@ app.layout = html.Div(children=[
                     dcc.Loading(id='loading-sales-graph', children=[
                         dcc.Graph(id='sales-graph', 
                                   style={'display':'inline-block'}),
+                        # packed figure, see payload.py
+                        dcc.Store(id='sales-graph-data'),
                     ], className='six columns'),
                     dcc.Loading(id='loading-orders-graph', children=[
                         dcc.Graph(id='orders-graph', 
@@ -192,7 +251,9 @@ app.layout = html.Div(children=[
                         dcc.Graph(id='sales-map',
                                   style={'display':'inline-block'}),
                         dcc.Graph(id='product-sales-map',
-                                  style={'display':'inline-block'})
+                                  style={'display':'inline-block'}),
+                        dcc.Store(id='sales-map-data'),
+                        dcc.Store(id='product-sales-map-data')
                     ], className='row'),
     
                     # Revenue table
@@ -203,7 +264,7 @@ app.layout = html.Div(children=[
             ]),
            
            ## TAB 2 ##
-           dcc.Tab(id='customer-tab', label='Customer', children=[
+           dcc.Tab(id='customer-tab', label='Customer', value='customer', children=[
                 html.Br(),
                 dcc.Loading(id='loading-customer-tab', children=[
                     # indicators row
@@ -232,7 +293,28 @@ app.layout = html.Div(children=[
                     html.Br(),
                     
                     html.Div([
-                        dcc.Graph(id='spenders-table'),
+                        html.P('Top Customers by Sales ($)',
+                               style={'font-size': '20px', 'color': '#2a3f5f'}),
+                        dash_table.DataTable(
+                            id='spenders-table',
+                            columns=[{'name': name, 'id': name}
+                                     for name, _ in SPENDERS_COLUMNS],
+                            page_action='custom',
+                            page_current=0,
+                            page_size=SPENDERS_PAGE_SIZE,
+                            sort_action='custom',
+                            sort_mode='single',
+                            sort_by=[],
+                            style_cell={'text-align': 'left',
+                                        'font-size': '15px'},
+                            style_header={'font-size': '16px',
+                                          'font-weight': 'bold'},
+                            style_data_conditional=[
+                                {'if': {'column_id': 'Total Sales ($)'},
+                                 'background-color': 'lightyellow'}]
+                        ),
+                        html.P(id='spenders-count',
+                               style={'font-size': '15px', 'color': '#A9A9A9'}),
                     ],
                     className='row',
                     style={'float':'center',
@@ -295,61 +377,27 @@ def indicator(text, value):
 ## SALES TAB CONTENT
 
 # Output: fig: Plotly figure that shows bar chart of sales over time
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
 #         scale_str: string, either "Monthly" / "Daily" / "Weekly" for time scale
 #         display_product: boolean of whether to subdivide chart by product
-def display_sales(df, scale_str, display_product=False):
+def display_sales(ds, scale_str, display_product=False):
     #colors
     category20 = ["#b4ddd4", "#1c5b5a", "#66fcba", "#b31f59", "#46a26c", "#4443b4", 
                   "#dc8bfe", "#9525ba", "#2499d7", "#67486a", "#a8a2f4", "#3f16f9", 
                   "#efd453", "#7d4400", "#fec9af", "#af3007", "#fb899b", "#f6932e", 
                   "#9d8d88", "#fb57f9"]
                   
-    # Change dataframe to daily, weekly, monthly
-    def resample_sales(pivoted_orders, scale, to_process=False):
-
-            pivoted_orders = pivoted_orders.resample(scale, on='Date').sum() ##ding ding ding
-
-            if scale=='M':
-                pivoted_orders.index = pivoted_orders.index.strftime('%Y-%m')
-            elif scale=='W' or scale=='D':
-                pivoted_orders.index = pivoted_orders.index.strftime('%Y-%m-%d')
-            pivoted_orders = pivoted_orders.reset_index()
-            pivoted_orders = pivoted_orders.rename(columns=dict(index='Date'))
-            
-            if to_process:
-                pivoted_orders = pd.melt(pivoted_orders, id_vars=['Date'], 
-                                         value_vars=column_names,
-                                         var_name='Product Name',
-                                         value_name='Sales ($)')
-            return pivoted_orders
-        
-    # Subdivide data by product
+    # Subdivide data by product (top products + Other + Shipping, long form)
     if display_product == True:
-        product_sales = df.groupby(['Date','Product Name'], as_index=False)['Sales ($)'].sum()
-        pivoted_sales = product_sales.pivot(index='Date', columns='Product Name').fillna(value=0)
-        pivoted_sales['Date'] = pivoted_sales.index
-        pivoted_sales = pivoted_sales.reset_index(drop=True)
-
-        #get unique column names from data
-        column_names = list(filter(None,df['Product Name'].unique().astype(str)))
-        column_names = sorted([c for c in column_names if c != 'nan' and c != 'None'])
-        pivoted_sales.columns = np.append(column_names, 'Date')
-
-        #add shipping price to the category
-        shipping_price = df.groupby(['Date'], as_index=False)['Shipping Price'].sum()
-        pivoted_sales.loc[:,'Shipping'] = shipping_price['Shipping Price']
-        column_names = np.append(column_names,'Shipping')
-
-        fig = px.bar(resample_sales(pivoted_sales, scale_str[0], True), x='Date', y='Sales ($)', 
+        product_sales = ds.product_sales(scale_str[0], top_n=TOP_PRODUCTS)
+        fig = px.bar(product_sales, x='Date', y='Sales ($)', 
                      color='Product Name', 
+                     category_orders={'Product Name': list(product_sales['Product Name'].cat.categories)},
                      title='%s Sales ($) by product distribution' % scale_str,
                      color_discrete_sequence=category20)
     else: #just show aggregate
-        daily_sales = df.groupby('Date', as_index=False)['Subtotal','Shipping Price'].sum()
-        daily_sales.loc[:,'Sales ($)'] = daily_sales.loc[:,'Subtotal'] + daily_sales.loc[:,'Shipping Price']
-        daily_sales = resample_sales(daily_sales, scale_str[0])
-        fig = px.bar(daily_sales, x='Date', y='Sales ($)', title='%s Overall Sales' % scale_str)
+        fig = px.bar(ds.sales_series(scale_str[0]), x='Date', y='Sales ($)',
+                     title='%s Overall Sales' % scale_str)
         fig.update_traces(marker_color='rgb(158,202,225)')
 
     # add date buttons
@@ -399,42 +447,22 @@ def display_sales(df, scale_str, display_product=False):
     return fig
 
 # Output: fig: Plotly figure that shows bar chart of # of orders over time
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
 #         scale_str: string, either "Monthly" / "Daily" / "Weekly" for time scale
 #         display_promo: boolean of whether to subdivide chart by coupon use
-def display_orders(df, scale_str, display_promo=False):
-    # Preprocessing
-    orders = df.drop_duplicates(subset='Order #').groupby('Date', as_index=False)['Order #', 'Coupon'].count()
-    orders = orders.rename(columns={'Order #': 'Total', 'Coupon': 'Promo'}) 
-    orders['Regular'] = np.subtract(orders['Total'], orders['Promo'])
-    
-    # Resample to make daily, weekly, or monthly data
-    def resample_orders(pivoted_orders, scale='D', display_promo=False):
-
-        pivoted_orders = pivoted_orders.resample(scale, on='Date').sum() ##ding ding ding
-
-        if scale=='M':
-            pivoted_orders.index = pivoted_orders.index.strftime('%Y-%m')
-        elif scale=='W' or scale=='D':
-            pivoted_orders.index = pivoted_orders.index.strftime('%Y-%m-%d')
-        pivoted_orders = pivoted_orders.reset_index()
-        pivoted_orders = pivoted_orders.rename(columns=dict(index='Date'))
-        
-        if display_promo:
-            pivoted_orders = pd.melt(pivoted_orders, id_vars=['Date'], 
-                                value_vars=['Regular', 'Promo'],
-                                var_name='Order type',
-                                value_name='# of orders')
-        return pivoted_orders
+def display_orders(ds, scale_str, display_promo=False):
+    orders = ds.order_series(scale_str[0])
     
     # Show division of orders by promo use
     if display_promo == True:
-        fig = px.bar(resample_orders(orders, scale_str[0], True), 
+        orders = pd.melt(orders, id_vars=['Date'], value_vars=['Regular', 'Promo'],
+                         var_name='Order type', value_name='# of orders')
+        fig = px.bar(orders, 
                      x='Date', y='# of orders', color='Order type',
                      title="# of %s Orders by order type" % scale_str)
 
     else: #just show aggregate  
-        fig = px.bar(resample_orders(orders,scale=scale_str[0]), x='Date', y='Total',
+        fig = px.bar(orders, x='Date', y='Total',
                      title="Total Number of %s Orders" % scale_str)
         fig.update_yaxes(title='# of orders')
 
@@ -488,25 +516,10 @@ def display_orders(df, scale_str, display_promo=False):
 
 # Output: fig1: Plotly figure that shows dots of sales mapped to US zipcodes
 #         fig2: Same as fig1 except subdivided by product
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def generate_sales_maps(df):
-    # Preprocessing for figure 1
-    single_orders = df.drop_duplicates('Order #').reset_index(drop=True)
-    single_orders = single_orders.groupby(['Shipping Postal Code', 'Shipping City'], 
-                                          as_index=False).sum()
-    
-    zips = single_orders['Shipping Postal Code'].astype(int).astype(str)
-    
-    # Converting zip code to latitude and longitude
-    search = SearchEngine()
-    lat = []
-    long = []
-    for z in zips:
-        info = search.by_zipcode(z)
-        lat.append(info.lat)
-        long.append(info.lng)      
-    single_orders['lat'] = pd.Series(lat)
-    single_orders['long'] = pd.Series(long)
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def generate_sales_maps(ds):
+    # Subtotal, latitude and longitude per zip code
+    single_orders = ds.zip_sales()
     
     #remove outlier
     #single_orders = single_orders.loc[single_orders.loc[:,'Subtotal']<250,:] #minus the $250 outlier order
@@ -543,25 +556,9 @@ def generate_sales_maps(df):
         ),
     )
     
-    # Preprocessing for figure 2
-    filled_df = df.fillna(method='ffill')
-    zipcodes = filled_df['Shipping Postal Code'].astype(int).astype(str)
-    order2zip = dict(zip( filled_df['Order #'], zipcodes)) #could potentially use this for re-adding dates back to orders hm
-    product_orders = filled_df.groupby(['Order #','Product Name', 'Shipping City'], as_index=False).sum()
-    product_orders["Shipping Postal Code"] = product_orders["Order #"].map(order2zip)
-    
-    
-    # Converting zip code to latitude and longitude
-    search = SearchEngine()
-    lat = []
-    long = []
-    for z in product_orders['Shipping Postal Code']:
-        info = search.by_zipcode(z)
-        lat.append(info.lat)
-        long.append(info.lng)      
-    product_orders['lat'] = pd.Series(lat)
-    product_orders['long'] = pd.Series(long)
-    product_orders
+    # Same per zip code x product
+    product_orders = ds.zip_product_sales()
+    product_orders["Shipping Postal Code"] = product_orders["Shipping Postal Code"].astype(int).astype(str)
     
     #figure
     fig2 = px.scatter_geo(product_orders, lat='lat', lon='long', 
@@ -605,31 +602,19 @@ def generate_sales_maps(df):
     return fig1,fig2
 
 # Output: fig: Plotly figure that shows table of each product and its sales
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def revenue_table(df):
-    today = dt.today().strftime('%Y-%m-%d')
-    mnth = (dt.today() - timedelta(days=30)).strftime('%Y-%m-%d')
-    mnths3 = (dt.today() - timedelta(weeks=13)).strftime('%Y-%m-%d')
-    yr = (dt.today() - timedelta(weeks=52)).strftime('%Y-%m-%d')
-    
-    
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def revenue_table(ds):
     def generate_prods(data):
-        ## From csv, returns dataframe with product name, Qty, Sales, % of Sales
-        prods = data.groupby(['Product Name'], as_index=False)['Product Quantity','Sales ($)'].sum()
-        ship = pd.DataFrame([['Shipping',data['Shipping Price'].count(),data['Shipping Price'].sum()]], 
-                 columns=['Product Name', 'Product Quantity', 'Sales ($)'])
-        prods = prods.append(ship, ignore_index=True)
-        prods['% of Total Sales'] = np.divide(prods['Sales ($)'], prods['Sales ($)'].sum())*100
-        prods = prods.sort_values(by='Sales ($)', ascending=False).append(prods.sum().rename('Total'))
-        prods = prods.reset_index(drop=True)
-        prods = prods.round(2)
-        prods.tail(1).loc[:,'Product Name'] = ['<b>Total</b>']
+        ## Product name, Qty, Sales, % of Sales of the window (+ Total row)
+        prods = data.product_revenue().round(2)
+        prods.iloc[-1, 0] = '<b>Total</b>'
         return prods
     
-    all_prods = generate_prods(df)
-    mnth_prods = generate_prods(df.loc[(df['Date'] >= mnth) & (df['Date'] <=today)])
-    mnths3_prods = generate_prods(df.loc[(df['Date'] >= mnths3) & (df['Date'] <=today)])
-    yr_prods = generate_prods(df.loc[(df['Date'] >= yr) & (df['Date'] <=today)])
+    windows = ds.recent()
+    all_prods = generate_prods(windows['All'])
+    mnth_prods = generate_prods(windows['1m'])
+    mnths3_prods = generate_prods(windows['3m'])
+    yr_prods = generate_prods(windows['1yr'])
     
     fig = go.Figure()
     
@@ -726,51 +711,37 @@ def revenue_table(df):
 
 ## CUSTOMER TAB CONTENT
 
+# Output: adds one bar trace per histogram to fig, only the first visible
+# Input:  fig: Plotly figure
+#         edges: bin edges shared by the histograms
+#         windows: list of arrays of counts per bin (e.g. All/1m/3m/1yr)
+#         integer: True if the values are counts (bins of whole numbers)
+def add_histogram_bars(fig, edges, windows, integer=False):
+    centers = np.round((edges[:-1] + edges[1:]) / 2, 6)
+    widths = np.diff(edges)
+    if integer and widths[0] == 1:
+        hover = '%{x}: %{y}<extra></extra>'
+    else:
+        hover = '%{customdata[0]:,.2f} - %{customdata[1]:,.2f}: %{y}<extra></extra>'
+    bounds = np.round(np.column_stack([edges[:-1], edges[1:]]), 6)
+
+    for i, counts in enumerate(windows):
+        fig.add_trace(
+          go.Bar(x=centers, y=counts, width=widths,
+                 customdata=bounds, hovertemplate=hover,
+                 visible=(i == 0))
+        )
+    fig.update_layout(bargap=0)
+
 # Output: fig: Plotly figure that shows histogram of dollars spent per order
 #         avg: Float which is the average purchase ($) per order
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def dollars_histogram(df):
-    # Get dates
-    today = dt.today().strftime('%Y-%m-%d')
-    mnth = (dt.today() - timedelta(days=30)).strftime('%Y-%m-%d')
-    mnths3 = (dt.today() - timedelta(weeks=13)).strftime('%Y-%m-%d')
-    yr = (dt.today() - timedelta(weeks=52)).strftime('%Y-%m-%d')
-    
-    # Groupby spending
-    def generate_spend(data):
-        ## From csv, returns dataframe with product name, Qty, Sales, % of Sales
-        prods = data.groupby(['Order #'], as_index=False).sum()
-        return prods
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def dollars_histogram(ds):
+    # Spending per order of the All/1m/3m/1yr windows, binned server-side
+    edges, counts = ds.spend_distribution()
     
-    # Filter data
-    all_prods = generate_spend(df)
-    mnth_prods = generate_spend(df.loc[(df['Date'] >= mnth) & (df['Date'] <=today)])
-    mnths3_prods = generate_spend(df.loc[(df['Date'] >= mnths3) & (df['Date'] <=today)])
-    yr_prods = generate_spend(df.loc[(df['Date'] >= yr) & (df['Date'] <=today)])
-    
-    # Generate figure
     fig = go.Figure()
-    
-    fig.add_trace(
-      go.Histogram(x=all_prods['Subtotal']+all_prods['Shipping Price'])
-    )
-    
-    fig.add_trace(
-      go.Histogram(x=mnth_prods['Subtotal']+mnth_prods['Shipping Price'],
-      visible=False)
-    )
-    
-    
-    fig.add_trace(
-      go.Histogram(x=mnths3_prods['Subtotal']+mnths3_prods['Shipping Price'],
-      visible=False)
-    )
-    
-    
-    fig.add_trace(
-      go.Histogram(x=yr_prods['Subtotal']+yr_prods['Shipping Price'],
-      visible=False)
-    )
+    add_histogram_bars(fig, edges, list(counts.values()))
     
     fig.update_layout(title="Dollars ($) spent per order - All orders to date",
                       xaxis=dict(title='Dollars ($) spent per order'),
@@ -810,55 +781,19 @@ def dollars_histogram(df):
     fig.update_yaxes(tickfont=dict(size=15.5), title_font=dict(size=20))
     
     #avg spend/order KPI
-    avg = (all_prods.loc[:,'Subtotal'] + all_prods.loc[:,'Shipping Price']).mean() 
+    avg = ds.orders['Total'].mean() 
     
     return fig,avg
 
 # Output: fig: Plotly figure that shows histogram of # of orders made per cust
 #         avg: Float which is the average # of orders per customer
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def orders_histogram(df):
-    # Get dates
-    today = dt.today().strftime('%Y-%m-%d')
-    mnth = (dt.today() - timedelta(days=30)).strftime('%Y-%m-%d')
-    mnths3 = (dt.today() - timedelta(weeks=13)).strftime('%Y-%m-%d')
-    yr = (dt.today() - timedelta(weeks=52)).strftime('%Y-%m-%d')
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def orders_histogram(ds):
+    # Orders per customer of the All/1m/3m/1yr windows, binned server-side
+    edges, counts = ds.order_count_distribution()
     
-    #Groupby orders
-    def generate_orders(data):
-        ## From csv, returns dataframe with product name, Qty, Sales, % of Sales
-        prods = data.groupby(['Shipping Email', 'Shipping Postal Code','Shipping Region'], as_index=False)['Order #'].count().sort_values(by='Order #', ascending=False)
-        return prods
-    
-    # Filtered data frames
-    all_prods = generate_orders(df)
-    mnth_prods = generate_orders(df.loc[(df['Date'] >= mnth) & (df['Date'] <=today)])
-    mnths3_prods = generate_orders(df.loc[(df['Date'] >= mnths3) & (df['Date'] <=today)])
-    yr_prods = generate_orders(df.loc[(df['Date'] >= yr) & (df['Date'] <=today)])
-    
-    # Generate figures
     fig = go.Figure()
-    
-    fig.add_trace(
-      go.Histogram(x=all_prods['Order #'])
-    )
-    
-    fig.add_trace(
-      go.Histogram(x=mnth_prods['Order #'],
-      visible=False)
-    )
-    
-    
-    fig.add_trace(
-      go.Histogram(x=mnths3_prods['Order #'],
-      visible=False)
-    )
-    
-    
-    fig.add_trace(
-      go.Histogram(x=yr_prods['Order #'],
-      visible=False)
-    )
+    add_histogram_bars(fig, edges, list(counts.values()), integer=True)
     
     fig.update_layout(title="# of orders per customer - All orders to date",
                       xaxis=dict(title='# of orders'),
@@ -896,66 +831,46 @@ def orders_histogram(df):
     fig.update_xaxes(tick0=0, dtick=1, tickfont=dict(size=15.5), title_font=dict(size=20))
     fig.update_yaxes(tickfont=dict(size=15.5), title_font=dict(size=20))
     
-    avg = all_prods['Order #'].mean() #avg orders per cust
+    avg = ds.customer_stats()['Orders'].mean() #avg orders per cust
     
     return fig, avg
 
-# Output: fig: Plotly figure that shows table of top spending customers + info
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def spenders_table(df):
-    ## TOP SPENDERS
-    top_spenders = df.groupby(['Shipping First Name', 'Shipping Last Name','Shipping Email','Shipping City','Shipping Region'], as_index=False).sum().sort_values(by='Subtotal', ascending=False)
-    top_spenders['Total Sales ($)'] = top_spenders.loc[:,'Subtotal']+top_spenders.loc[:,'Shipping Price']
-    top_spenders = top_spenders.round(2)
-    top_spenders = top_spenders.rename(columns={'Shipping Region':'State',
-                                 'Shipping Email':'Email', 
-                                 'Shipping City':'City',
-                                 'Shipping First Name':'First Name',
-                                 'Shipping Last Name':'Last Name'})
-    top_spenders = top_spenders[['First Name', 'Last Name', 'Email', 'City','State','Total Sales ($)']]
-    fig = go.Figure()
-    
-    fig.add_trace(
-      go.Table(
-        columnwidth=[60,60,120,60,40,60, 40],
-        header=dict(values=list(top_spenders.columns),
-                    align='left',
-                    font=dict(size=16)
-                   ),
-        cells=dict(
-            values=top_spenders.values.transpose(),
-            align='left',
-            fill=dict(color=['rgba(220,220,220,0.3)','rgba(220,220,220,0.3)','rgba(220,220,220,0.3)','rgba(220,220,220,0.3)','rgba(220,220,220,0.3)',
-                             'lightyellow']),
-            font=dict(size=15)
-        ),
-      )
-    )
-    
-    fig.update_layout(title="Top Customers by Sales ($)",
-                      titlefont=dict(size=20),
-                      margin=go.layout.Margin(
-                        l=40,
-                        r=20,
-                        b=0,
-                        t=50,
-                        pad=4
-                      )
-    )
-                      
-    return fig
+# Output: rows: list of dicts, one page of the top customers table
+#         n_customers: Int which is the # of customers in the whole table
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+#         page: Int, 0-based page number
+#         page_size: Int, # of rows per page
+#         sort_by: list of {'column_id', 'direction'} dicts from the table,
+#                  empty for the default order (highest subtotal first)
+def spenders_table(ds, page, page_size, sort_by):
+    column, ascending = 'Subtotal', False
+    if sort_by:
+        column = dict(SPENDERS_COLUMNS)[sort_by[0]['column_id']]
+        ascending = sort_by[0]['direction'] == 'asc'
+    
+    top_spenders, n_customers = ds.top_customers(page * page_size, page_size,
+                                                 column, ascending)
+    
+    top_spenders = pd.DataFrame({name: top_spenders[col].values
+                                 for name, col in SPENDERS_COLUMNS},
+                                columns=[name for name, _ in SPENDERS_COLUMNS])
+    top_spenders['Last Purchase'] = top_spenders['Last Purchase'].dt.strftime('%Y-%m-%d')
+    top_spenders['Total Sales ($)'] = top_spenders['Total Sales ($)'].round(2)
+    top_spenders = top_spenders.astype(object).where(top_spenders.notnull(), '')
+    
+    return top_spenders.to_dict('records'), n_customers
 
 # Output: fig: Plotly figure that shows histogram of lifetime spending / cust
 #         avg: Float which is the average lifetime spending ($) of a customer
-# Input:  df: pandas dataframe (ideally from filtered-dataframe div element)
-def lifetime_histogram(df):
-    cust_df = df.groupby(['Shipping Email'], as_index=False).sum()
-    cust_df['Total Spending ($)'] = cust_df.loc[:,'Subtotal'] + cust_df.loc[:,'Shipping Price']
-    
-    fig = px.histogram(cust_df, x='Total Spending ($)')
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def lifetime_histogram(ds):
+    edges, counts = ds.lifetime_distribution()
     
+    fig = go.Figure()
+    add_histogram_bars(fig, edges, [counts])
     
     fig.update_layout(title="Lifetime Customer Sales ($)",
+                      xaxis=dict(title='Total Spending ($)'),
                       yaxis=dict(title='# of customers'),
                       titlefont=dict(size=20)
                      )
@@ -965,193 +880,215 @@ def lifetime_histogram(df):
     fig.update_xaxes(tick0=0, tickfont=dict(size=15.5), title_font=dict(size=20))
     fig.update_yaxes(tickfont=dict(size=15.5), title_font=dict(size=20))
     
-    avg = cust_df['Total Spending ($)'].mean()
+    avg = ds.customer_stats()['Total Sales ($)'].mean()
     
     return fig, avg
-            
+
+# Output: Float which is the % of customers with a female first name
+# Input:  ds: StoreDataset (ideally from filtered-dataframe div element)
+def female_percentage(ds):
+    # genders are guessed once per customer at upload (see genders.py)
+    return ds.female_share()
+
 ### CALLBACK FUNCTIONS
 
-# After data has been uploaded, update figures with no user input (Both tabs)                     
-#@app.callback([Output('customer-indicators', 'children'),
-#               Output('dollars-histogram', 'figure'),
-#               Output('orders-histogram', 'figure'),
-#               Output('spenders-table', 'figure'),
-#               Output('lifetime-histogram', 'figure')],
-#              [Input('filtered-dataframe', 'children')])
-#def render_customer_tab(json_data):
-#    if json_data is not None:
-#        df = pd.read_json(json_data)
-#        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-#        df['Date'] = pd.to_datetime(df['Date'])
-#        
-#
-#        d_hist, avg_spend_order = dollars_histogram(df)
-#        o_hist, avg_orders_cust = orders_histogram(df)
-#        s_table = spenders_table(df)
-#        l_hist, avg_cust_spend = lifetime_histogram(df)
-#        
-#        d = gender.Detector()
-#        unique_emails = df.drop_duplicates(subset='Shipping Email')
-#        first_names = unique_emails['Shipping First Name'].str.lower().dropna()
-#        genders = [d.get_gender(str(i).capitalize()) for i in first_names]
-#        gender_dict = dict(zip(*np.unique(genders,return_counts=True)))
-#        
-#        male_count = 0
-#        female_count = 0
-#        unknown_count = 0
-#        
-#        if 'female' in gender_dict:
-#            female_count = female_count + gender_dict['female']
-#        if 'mostly_female' in gender_dict:
-#            female_count = female_count + gender_dict['mostly_female']
-#        if 'male' in gender_dict:
-#            male_count = male_count + gender_dict['male']
-#        if 'mostly_male' in gender_dict:
-#            male_count = male_count + gender_dict['mostly_male']
-#        if 'unknown' in gender_dict:
-#            unknown_count = unknown_count + gender_dict['unknown']
-#            
-#        if male_count == female_count == unknown_count == 0:
-#            female_pct = 0
-#        else:
-#            female_pct = (female_count/(female_count+male_count+unknown_count))*100
-#    
-#        
-#        indicators = html.Div([
-#            indicator('Avg lifetime spend / customer', '$%.2f' % avg_cust_spend),
-#            indicator('Avg purchase / order', '$%.2f' % avg_spend_order),
-#            indicator('% Female Customers', '%.1f%%' % female_pct)
-#        ])
-#        return indicators,d_hist,o_hist,s_table,l_hist
-#    else:
-#        return None,{},{},{},{}
+# Output: StoreDataset restricted to the date range of the fingerprint, or
+#         None if the fingerprint/dataset is unknown or expired. Filtering is
+#         a cheap binary search, so every callback redoes it on the shared
+#         (cached) dataset instead of storing filtered copies.
+# Input:  fingerprint: contents of the filtered-dataframe div
+def load_filtered(fingerprint):
+    window = store.get(fingerprint)
+    if window is None:
+        return None
+    ds = store.get(window['dataset'])
+    if ds is None:
+        return None
+    return ds.between(window['start'], window['end'])
+
+# Output: figure(s) built by build(filtered dataset), or served from the
+#         figure cache if this view was built before. None if the
+#         fingerprint/dataset is unknown or expired.
+# Input:  key: tuple of the figure name and its view options
+#         fingerprint: contents of the filtered-dataframe div
+#         build: function from StoreDataset to figure(s)
+def cached_figure(key, fingerprint, build):
+    def build_figure():
+        ds = load_filtered(fingerprint)
+        if ds is None:
+            return None
+        with stage('build_figure'):
+            return build(ds)
+    return figures.get_or_build((fingerprint,) + key, build_figure)
 
 # Create/adjust salesfigures based on change in checkbox (Sales Tab)
-@app.callback(Output('sales-graph', 'figure'),
+@app.callback(Output('sales-graph-data', 'data'),
               [Input('sales-checkbox','value'),
                Input('sales-time-dropdown', 'value'),
-               Input('filtered-dataframe', 'children')])
-def update_sales_graph(sales_cb, timestep, json_data):
-    if json_data is not None:
-        df = pd.read_json(json_data)
-        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-        # Return figures depending on checkbox value
-        if sales_cb: #box is checked
-            sales_fig = display_sales(df, timestep, display_product=True)
-        else:
-            sales_fig = display_sales(df, timestep, display_product=False)
-        
-        return sales_fig
-    else:
-        return {}
+               Input('sales-fingerprint', 'children')])
+def update_sales_graph(sales_cb, timestep, fingerprint):
+    # Return figures depending on checkbox value (checked = by product)
+    display_product = bool(sales_cb)
+    sales_fig = cached_figure(('sales-graph', timestep, display_product), fingerprint,
+                              lambda ds: pack_figure(display_sales(ds, timestep,
+                                                                   display_product=display_product)))
+    return sales_fig
     
 # Create/adjust orders figures based on change in checkbox (Sales Tab)
 @app.callback(Output('orders-graph', 'figure'),
               [Input('orders-checkbox', 'value'),
                Input('sales-time-dropdown', 'value'),
-               Input('filtered-dataframe', 'children')])
-def update_orders_graph(orders_cb, timestep, json_data):
-    if json_data is not None:
-        df = pd.read_json(json_data)
-        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-        if orders_cb:
-            orders_fig = display_orders(df, timestep, display_promo=True)
-        else:
-            orders_fig = display_orders(df, timestep, display_promo=False)
-        
-        return orders_fig
-    else:
-        return {}
+               Input('sales-fingerprint', 'children')])
+def update_orders_graph(orders_cb, timestep, fingerprint):
+    display_promo = bool(orders_cb)
+    orders_fig = cached_figure(('orders-graph', timestep, display_promo), fingerprint,
+                               lambda ds: display_orders(ds, timestep, display_promo=display_promo))
+    return orders_fig if orders_fig is not None else {}
 
-# Filters dataframe based on date range and outputs new dataframe and figures
-@app.callback([Output('sales-indicators','children'),
-               Output('filtered-dataframe', 'children'),
-               Output('revenue-table', 'figure'),
-               Output('sales-map', 'figure'),
-               Output('product-sales-map','figure'),
-               Output('customer-indicators', 'children'),
-               Output('dollars-histogram', 'figure'),
-               Output('orders-histogram', 'figure'),
-               Output('spenders-table', 'figure'),
-               Output('lifetime-histogram', 'figure')],
+# Filters dataset based on date range, every figure below reads the
+# filtered dataset through the fingerprint in the filtered-dataframe div
+@app.callback(Output('filtered-dataframe', 'children'),
               [Input('sales-datepickerrange', 'start_date'),
                Input('sales-datepickerrange', 'end_date'),
                Input('dataframe', 'children')]
              )
-def update_df_figures(start_date, end_date, json_data):
-    if json_data and start_date and end_date is not None:
-        # Retrieve dataframe and preprocess
-        df = pd.read_json(json_data)
-        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-        start_date = dateutil.parser.parse(start_date)
-        end_date = dateutil.parser.parse(end_date)
+def update_filter(start_date, end_date, dataset_id):
+    if store.get(dataset_id) is not None and start_date and end_date is not None:
+        fingerprint = filter_fingerprint(dataset_id, start_date, end_date)
+        store.put({'dataset': dataset_id,
+                   'start': dateutil.parser.parse(start_date),
+                   'end': dateutil.parser.parse(end_date)}, key=fingerprint)
+        return fingerprint
+    else:
+        return None
 
-        # Create filtered dataframe between datepickerrange dates
-        mask = (df['Date'] >= start_date) & (df['Date'] <= end_date)
-        df = df.loc[mask]
-        
-        d_hist, avg_spend_order = dollars_histogram(df)
-        o_hist, avg_orders_cust = orders_histogram(df)
-        s_table = spenders_table(df)
-        l_hist, avg_cust_spend = lifetime_histogram(df)
-        
-        d = gender.Detector()
-        unique_emails = df.drop_duplicates(subset='Shipping Email')
-        first_names = unique_emails['Shipping First Name'].str.lower().dropna()
-        genders = [d.get_gender(str(i).capitalize()) for i in first_names]
-        gender_dict = dict(zip(*np.unique(genders,return_counts=True)))
-        
-        male_count = 0
-        female_count = 0
-        unknown_count = 0
-        
-        if 'female' in gender_dict:
-            female_count = female_count + gender_dict['female']
-        if 'mostly_female' in gender_dict:
-            female_count = female_count + gender_dict['mostly_female']
-        if 'male' in gender_dict:
-            male_count = male_count + gender_dict['male']
-        if 'mostly_male' in gender_dict:
-            male_count = male_count + gender_dict['mostly_male']
-        if 'unknown' in gender_dict:
-            unknown_count = unknown_count + gender_dict['unknown']
-            
-        if male_count == female_count == unknown_count == 0:
-            female_pct = 0
-        else:
-            female_pct = (female_count/(female_count+male_count+unknown_count))*100
-    
-        
-        indicators = html.Div([
+# Output: fingerprint a tab's figures should show, unchanged (no update)
+#         while the tab is hidden or already shows it. Figures of hidden
+#         tabs are computed when the tab is first opened after a change.
+# Input:  active_tab: value of the tabs component
+#         tab: value of the tab the fingerprint is for
+#         fingerprint: contents of the filtered-dataframe div
+#         rendered: fingerprint the tab's figures currently show
+def tab_fingerprint(active_tab, tab, fingerprint, rendered):
+    if active_tab != tab or fingerprint == rendered:
+        raise PreventUpdate
+    return fingerprint
+
+@app.callback(Output('sales-fingerprint', 'children'),
+              [Input('tabs', 'value'),
+               Input('filtered-dataframe', 'children')],
+              [State('sales-fingerprint', 'children')])
+def update_sales_fingerprint(active_tab, fingerprint, rendered):
+    return tab_fingerprint(active_tab, 'sales', fingerprint, rendered)
+
+@app.callback(Output('customer-fingerprint', 'children'),
+              [Input('tabs', 'value'),
+               Input('filtered-dataframe', 'children')],
+              [State('customer-fingerprint', 'children')])
+def update_customer_fingerprint(active_tab, fingerprint, rendered):
+    return tab_fingerprint(active_tab, 'customer', fingerprint, rendered)
+
+# KPIs of the date range (Sales Tab)
+@app.callback(Output('sales-indicators','children'),
+              [Input('sales-fingerprint', 'children')])
+def update_sales_indicators(fingerprint):
+    ds = load_filtered(fingerprint)
+    if ds is not None:
+        totals = ds.totals()
+        return html.Div([
+            indicator('Avg daily sales', '$%.2f' % (totals['Total'] / max(totals['Orders'], 1))),
+            indicator('Total sales', '$%.2f' % totals['Total']),
+            indicator('# of orders', totals['Orders'])
+        ])
+    else:
+        return None
+
+# Revenue by product table (Sales Tab)
+@app.callback(Output('revenue-table', 'figure'),
+              [Input('sales-fingerprint', 'children')])
+def update_revenue_table(fingerprint):
+    # 1m/3m/1yr windows are relative to today
+    fig = cached_figure(('revenue-table', dt.today().strftime('%Y-%m-%d')), fingerprint,
+                        revenue_table)
+    return fig if fig is not None else {}
+
+# US sales maps (Sales Tab)
+@app.callback([Output('sales-map-data', 'data'),
+               Output('product-sales-map-data','data')],
+              [Input('sales-fingerprint', 'children')])
+def update_sales_maps(fingerprint):
+    figs = cached_figure(('sales-maps',), fingerprint,
+                         lambda ds: [pack_figure(fig) for fig in generate_sales_maps(ds)])
+    return figs if figs is not None else [None, None]
+
+# Packed figures are unpacked in the browser (assets/figures.js)
+for graph in ['sales-graph', 'sales-map', 'product-sales-map']:
+    app.clientside_callback(ClientsideFunction('figures', 'unpack'),
+                            Output(graph, 'figure'),
+                            [Input(graph + '-data', 'data')])
+
+# KPIs of the date range (Customer Tab)
+@app.callback(Output('customer-indicators', 'children'),
+              [Input('customer-fingerprint', 'children')])
+def update_customer_indicators(fingerprint):
+    ds = load_filtered(fingerprint)
+    if ds is not None:
+        totals = ds.totals()
+        avg_cust_spend = ds.customer_stats()['Total Sales ($)'].mean()
+        avg_spend_order = totals['Total'] / max(totals['Orders'], 1)
+        return html.Div([
             indicator('Avg lifetime spend / customer', '$%.2f' % avg_cust_spend),
             indicator('Avg purchase / order', '$%.2f' % avg_spend_order),
-            indicator('% Female Customers', '%.1f%%' % female_pct)
+            indicator('% Female Customers', '%.1f%%' % female_percentage(ds))
         ])
-
-        return [html.Div([
-                indicator('Avg daily sales', '$%.2f' % (df['Subtotal']+df['Shipping Price']).mean()),
-                indicator('Total sales', '$%.2f' % (df['Subtotal']+df['Shipping Price']).sum()),
-                indicator('# of orders', len(df['Order #'].unique()))
-                ]), 
-                df.to_json(date_format='iso'),
-                revenue_table(df),
-                *generate_sales_maps(pd.read_json(json_data)),
-                indicators,
-                d_hist,
-                o_hist,
-                s_table,
-                l_hist]
-        # Output filtered dataframe
     else:
-        return [None,None,{},{},{},None,{},{},{},{}]
-    
-       
+        return None
+
+# Dollars per order histogram (Customer Tab)
+@app.callback(Output('dollars-histogram', 'figure'),
+              [Input('customer-fingerprint', 'children')])
+def update_dollars_histogram(fingerprint):
+    fig = cached_figure(('dollars-histogram', dt.today().strftime('%Y-%m-%d')), fingerprint,
+                        lambda ds: dollars_histogram(ds)[0])
+    return fig if fig is not None else {}
+
+# Orders per customer histogram (Customer Tab)
+@app.callback(Output('orders-histogram', 'figure'),
+              [Input('customer-fingerprint', 'children')])
+def update_orders_histogram(fingerprint):
+    fig = cached_figure(('orders-histogram', dt.today().strftime('%Y-%m-%d')), fingerprint,
+                        lambda ds: orders_histogram(ds)[0])
+    return fig if fig is not None else {}
+
+# Top customers table (Customer Tab), only the current page is sent
+@app.callback([Output('spenders-table', 'data'),
+               Output('spenders-count', 'children')],
+              [Input('customer-fingerprint', 'children'),
+               Input('spenders-table', 'page_current'),
+               Input('spenders-table', 'page_size'),
+               Input('spenders-table', 'sort_by')])
+def update_spenders_table(fingerprint, page, page_size, sort_by):
+    page = page or 0
+    page_size = page_size or SPENDERS_PAGE_SIZE
+    sort_key = tuple((s['column_id'], s['direction']) for s in sort_by or [])
+    table = cached_figure(('spenders-table', page, page_size, sort_key), fingerprint,
+                          lambda ds: spenders_table(ds, page, page_size, sort_by))
+    if table is None:
+        return [], ''
+    rows, n_customers = table
+    if not rows:
+        return rows, '%d customers' % n_customers
+    first = page * page_size + 1
+    last = first + len(rows) - 1
+    return rows, 'Showing %d-%d of %d customers' % (first, last, n_customers)
+
+# Lifetime spending histogram (Customer Tab)
+@app.callback(Output('lifetime-histogram', 'figure'),
+              [Input('customer-fingerprint', 'children')])
+def update_lifetime_histogram(fingerprint):
+    fig = cached_figure(('lifetime-histogram',), fingerprint,
+                        lambda ds: lifetime_histogram(ds)[0])
+    return fig if fig is not None else {}
 
 # Updates all date picker range settings based on uploaded file
 @app.callback([Output('sales-datepickerrange', 'min_date_allowed'),
@@ -1159,16 +1096,13 @@ def update_df_figures(start_date, end_date, json_data):
                Output('sales-datepickerrange', 'start_date'),
                Output('sales-datepickerrange', 'end_date')],
               [Input('dataframe', 'children')])
-def setup_date_range(json_data):
-    if json_data is not None:
-        df = pd.read_json(json_data)
-        df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-        df['Date'] = pd.to_datetime(df['Date'])
-        
+def setup_date_range(dataset_id):
+    ds = store.get(dataset_id)
+    if ds is not None:
         ## Adjust min/max ranges on datepickerrange
         
-        min_date = min(df['Date'])
-        max_date = max(df['Date'])
+        min_date = min(ds.orders['Date'])
+        max_date = max(ds.orders['Date'])
         
         #add an extra day to max day
         #max_date_str = max_date.split('-')
@@ -1181,41 +1115,61 @@ def setup_date_range(json_data):
     else:
         return [None,None,None,None]
 
-# Parses dataframe from file and displays upload status
-@app.callback([Output('dataframe', 'children'),
-               Output('filename', 'children')],
+# Queues the parsing of the uploaded file (and the precomputation of its
+# dataset) as a background job, so the request returns right away
+@app.callback(Output('upload-job', 'data'),
               [Input('upload-data', 'contents')],
-              [State('upload-data', 'filename')])
-def parse_file(contents, filename):
-    if contents is not None: #nothing uploaded
-        # Reading the file
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        try:
-            if 'csv' in filename:
-                # Assume that the user uploaded a CSV file
-                df = pd.read_csv(
-                    io.StringIO(decoded.decode('utf-8')))
-            elif 'xls' in filename:
-                # Assume that the user uploaded an excel file
-                df = pd.read_excel(io.BytesIO(decoded))
-            else: 
-                raise Exception('Not a CSV or excel file.')
-        except Exception as e:
-            print(e)
-            return [None, html.Div([
-                'There was an error processing this file. Please upload a proper CSV/excel file.'
-            ])]
-        
-        # Processing the file
-        df['Date'] = pd.to_datetime(df['Date']) # add datetime formatting
-        df['Shipping Email'] = df['Shipping Email'].str.lower() #converting to lower case
-        df['Shipping City'] = df['Shipping City'].str.title()
-        df = df.rename(columns={"Product Total Price": "Sales ($)"}) #rename column 
-        
-        return df.to_json(date_format='iso'), 'uploaded %s' % filename
+              [State('upload-data', 'filename'),
+               State('append-checkbox', 'value'),
+               State('dataframe', 'children')])
+def parse_file(contents, filename, append_cb, dataset_id):
+    if contents is None: #nothing uploaded
+        return None
+    # Append mode: merge the export into the current dataset
+    base_id = dataset_id if append_cb else None
+    return jobs.submit(contents, filename, base_id, store=store, parsed=parsed)
+
+# Output: upload status: the job's progress (stage, rows parsed) and a
+#         progress bar of the share of the file read
+# Input:  status: dict of the job's status (see jobs.JobProgress)
+def upload_progress(status):
+    stage = status.get('stage')
+    if stage is None:
+        text = 'Waiting to process %s' % status['filename']
+    elif stage == 'parse':
+        text = 'Reading %s: %s rows' % (status['filename'], format(status['rows'], ','))
     else:
-        return [None, '']
+        text = '%s %s (%s rows)' % (dict(jobs.STAGES)[stage], status['filename'],
+                                    format(status['rows'], ','))
+    
+    # reading the file is most of the work, the other stages share the rest
+    if stage in (None, 'parse'):
+        fraction = 0.7 * status.get('fraction', 0.0)
+    else:
+        fraction = 0.7 + 0.3 * (len(status['stages_done']) - 1) / (len(jobs.STAGES) - 1)
+    return html.Div([text + '...', html.Br(),
+                     html.Progress(value=str(round(fraction, 3)), max='1',
+                                   style={'width': '50%'})])
+
+# Polls the upload job: shows its progress while it runs, then hands the
+# dataset ID to the rest of the app (which fills in the figures)
+@app.callback([Output('dataframe', 'children'),
+               Output('filename', 'children'),
+               Output('upload-poll', 'disabled')],
+              [Input('upload-job', 'data'),
+               Input('upload-poll', 'n_intervals')])
+def poll_upload(job_id, n_intervals):
+    if job_id is None:
+        return [None, '', True]
+    status = jobs.status(job_id)
+    if status is None: # expired
+        return [dash.no_update, 'The upload expired, please upload the file again.', True]
+    if status['state'] == 'done':
+        return [status['dataset'], status['message'], True]
+    if status['state'] == 'error':
+        return [None, html.Div([status['message']]), True]
+    return [dash.no_update, upload_progress(status), False]
 
 if __name__ == '__main__':
+    warmup.start()
     app.run_server(debug=True)
\ No newline at end of file
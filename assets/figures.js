@@ -0,0 +1,98 @@
+/* Unpacks the figures encoded by payload.py (see pack_figure) for the
+   clientside callbacks in app.py. */
+(function() {
+    var TYPES = {
+        u1: Uint8Array, i1: Int8Array, u2: Uint16Array, i2: Int16Array,
+        u4: Uint32Array, i4: Int32Array, f4: Float32Array, f8: Float64Array
+    };
+
+    function decodeArray(packed) {
+        var bytes = atob(packed.b64);
+        var buffer = new Uint8Array(bytes.length);
+        for (var i = 0; i < bytes.length; i++) {
+            buffer[i] = bytes.charCodeAt(i);
+        }
+        var values = new TYPES[packed.dtype](buffer.buffer);
+        if (packed.divisor) {
+            var scaled = new Float64Array(values.length);
+            for (var j = 0; j < values.length; j++) {
+                scaled[j] = values[j] / packed.divisor;
+            }
+            values = scaled;
+        }
+        return values;
+    }
+
+    function decodeLabels(packed, table) {
+        var codes = decodeArray(packed.codes);
+        var labels = new Array(codes.length);
+        for (var i = 0; i < codes.length; i++) {
+            labels[i] = codes[i] < 0 ? null : table[codes[i]];
+        }
+        return labels;
+    }
+
+    function decodeDigits(packed) {
+        var numbers = decodeArray(packed.numbers);
+        var digits = new Array(numbers.length);
+        for (var i = 0; i < numbers.length; i++) {
+            digits[i] = String(numbers[i]);
+        }
+        return digits;
+    }
+
+    function decodeDates(packed) {
+        var days = decodeArray(packed.days);
+        var dates = new Array(days.length);
+        for (var i = 0; i < days.length; i++) {
+            dates[i] = new Date(days[i] * 86400000).toISOString().slice(0, 10);
+        }
+        return dates;
+    }
+
+    function decodeRows(packed, table) {
+        var columns = packed.columns.map(function(column) {
+            return unpack(column, table);
+        });
+        var n = columns.length ? columns[0].length : 0;
+        var rows = new Array(n);
+        for (var i = 0; i < n; i++) {
+            rows[i] = columns.map(function(column) { return column[i]; });
+        }
+        return rows;
+    }
+
+    /* table: the 'labels' list of the packed figure */
+    function unpack(value, table) {
+        if (Array.isArray(value)) {
+            return value.map(function(item) { return unpack(item, table); });
+        }
+        if (value === null || typeof value !== 'object') {
+            return value;
+        }
+        switch (value.__packed__) {
+            case 'array': return decodeArray(value);
+            case 'dates': return decodeDates(value);
+            case 'digits': return decodeDigits(value);
+            case 'labels': return decodeLabels(value, table);
+            case 'rows': return decodeRows(value, table);
+        }
+        var unpacked = {};
+        Object.keys(value).forEach(function(key) {
+            unpacked[key] = unpack(value[key], table);
+        });
+        return unpacked;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        figures: {
+            unpack: function(packed) {
+                if (!packed) {
+                    return {};
+                }
+                return {data: unpack(packed.data, packed.labels),
+                        layout: packed.layout};
+            }
+        }
+    });
+})();
@@ -0,0 +1,245 @@
+"""Benchmark of the upload and dashboard callbacks on synthetic exports.
+
+For every size (10k/100k/1M line items by default) a synthetic export is
+generated as CSV (see synthetic.py), uploaded through parse_file, and every
+dashboard callback and figure builder of app.py is run on it. Each step
+records
+
+  seconds        wall time, best of --repeat runs
+  peak_rss_mb    peak resident memory of the process during the step
+  payload_bytes  size of the JSON the step's result takes (for callbacks,
+                 what Dash sends to the browser)
+
+Figures aren't cached during the run, so every call builds its figure. The
+results are written as JSON; --baseline prints the change of every step
+against the JSON of an earlier run.
+
+Usage: python benchmarks/callbacks.py [--sizes 10000,100000,1000000]
+           [--repeat 3] [--out results.json] [--baseline old.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import app
+from datastore import DatasetStore
+from figcache import FigureCache
+from geocode import zip_table
+from parsecache import ParsedCache
+from sharedcache import FileBackend
+from synthetic import generate_export
+
+SIZES = [10000, 100000, 1000000]
+
+
+# Context manager sampling the resident memory of this process in a
+# background thread, peak_mb is the largest value seen
+class PeakRss(object):
+
+    INTERVAL = 0.002  # seconds between samples
+
+    def __init__(self):
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._record()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._record()
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self._record()
+
+    def _record(self):
+        self.peak_mb = max(self.peak_mb, rss_mb())
+
+
+# Output: Float which is the current resident memory of the process (MB),
+#         or its peak so far where /proc isn't available
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024.0 ** 2
+    except (IOError, OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 1024.0 ** (2 if sys.platform == 'darwin' else 1)
+
+
+# Output: Int which is the size of the JSON of result (figures included)
+def payload_bytes(result):
+    return len(json.dumps(result, cls=plotly.utils.PlotlyJSONEncoder))
+
+
+# Output: result of the last run and a dict of seconds, peak_rss_mb and
+#         payload_bytes of the step
+# Input:  run: function without arguments running the step once
+#         repeat: number of runs, the fastest is reported
+#         setup: optional function run before every run (not timed)
+def measure(run, repeat, setup=None):
+    best, peak = None, 0.0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with PeakRss() as rss:
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        peak = max(peak, rss.peak_mb)
+    return result, {'seconds': round(best, 6), 'peak_rss_mb': round(peak, 1),
+                    'payload_bytes': payload_bytes(result)}
+
+
+# Output: results: list of dicts, one per step, for one export size
+#         csv_bytes: Int which is the size of the uploaded CSV
+# Input:  n_rows: number of line items of the export
+#         repeat: runs per step
+#         workdir: directory for the caches of the run
+def bench_size(n_rows, repeat, workdir):
+    export = generate_export(n_rows, zipcodes='us')
+    csv = export.to_csv(index=False).encode('utf-8')
+    contents = 'data:text/csv;base64,' + base64.b64encode(csv).decode('ascii')
+    del export
+    results = []
+
+    def record(step, run, setup=None, kind='callback'):
+        result, stats = measure(run, repeat, setup)
+        stats.update(rows=n_rows, step=step, kind=kind)
+        results.append(stats)
+        print('%8d  %-40s %9.3fs %8.1f MB %11d B' % (
+            n_rows, step, stats['seconds'], stats['peak_rss_mb'], stats['payload_bytes']))
+        return result
+
+    def callback(name):
+        return getattr(app, name).__wrapped__
+
+    # upload: a new file, then the same file again (parsed cache hit)
+    def fresh_parsed_cache():
+        directory = os.path.join(workdir, 'parsed')
+        shutil.rmtree(directory, ignore_errors=True)
+        app.parsed = ParsedCache(directory)
+
+    # the job runs in this process (see main), poll_upload gets its dataset
+    def upload():
+        job_id = callback('parse_file')(contents, 'orders.csv', [], None)
+        return callback('poll_upload')(job_id, None)[0]
+    record('parse_file', upload, setup=fresh_parsed_cache)
+    dataset_id = record('parse_file (cached upload)', upload)
+
+    _, _, start, end = record('setup_date_range', lambda: callback('setup_date_range')(dataset_id))
+    fingerprint = record('update_filter', lambda: callback('update_filter')(
+        str(start)[:10], str(end)[:10], dataset_id))
+
+    for name in ['update_sales_indicators', 'update_revenue_table',
+                 'update_sales_maps', 'update_customer_indicators',
+                 'update_dollars_histogram', 'update_orders_histogram',
+                 'update_lifetime_histogram']:
+        record(name, lambda: callback(name)(fingerprint))
+    for timestep in ['Daily', 'Weekly', 'Monthly']:
+        for mode, checked in [('total', []), ('split', ['y'])]:
+            for name in ['update_sales_graph', 'update_orders_graph']:
+                record('%s (%s, %s)' % (name, timestep, mode),
+                       lambda: callback(name)(checked, timestep, fingerprint))
+    for page, sort_by in [(0, []), (50, [{'column_id': 'City', 'direction': 'asc'}])]:
+        record('update_spenders_table (page %d%s)' % (page, ', by City' if sort_by else ''),
+               lambda: callback('update_spenders_table')(
+                   fingerprint, page, app.SPENDERS_PAGE_SIZE, sort_by))
+
+    # figure builders on the dataset, without the packing of the callbacks
+    ds = app.load_filtered(fingerprint)
+    builders = [('display_sales (Daily, total)', lambda: app.display_sales(ds, 'Daily')),
+                ('display_sales (Daily, products)', lambda: app.display_sales(ds, 'Daily', True)),
+                ('display_orders (Daily, promo)', lambda: app.display_orders(ds, 'Daily', True)),
+                ('generate_sales_maps', lambda: app.generate_sales_maps(ds)),
+                ('revenue_table', lambda: app.revenue_table(ds)),
+                ('dollars_histogram', lambda: app.dollars_histogram(ds)),
+                ('orders_histogram', lambda: app.orders_histogram(ds)),
+                ('lifetime_histogram', lambda: app.lifetime_histogram(ds))]
+    for step, run in builders:
+        record(step, run, kind='builder')
+    return results, len(csv)
+
+
+# Prints the change of every step of results against the baseline run
+def compare(results, baseline):
+    before = {(r['rows'], r['step']): r for r in baseline['results']}
+    print('\n%8s  %-40s %10s %10s %10s' % ('rows', 'step', 'time', 'peak RSS', 'payload'))
+    for r in results:
+        old = before.get((r['rows'], r['step']))
+        if old is None:
+            continue
+        print('%8d  %-40s %9.2fx %+8.1fMB %+10d' % (
+            r['rows'], r['step'], r['seconds'] / max(old['seconds'], 1e-9),
+            r['peak_rss_mb'] - old['peak_rss_mb'], r['payload_bytes'] - old['payload_bytes']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)),
+                        help='comma separated numbers of line items')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per step')
+    parser.add_argument('--out', default='bench_results.json', help='JSON results file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    # upload jobs run in this process, so their time and memory are measured
+    os.environ['WEA_JOB_WORKERS'] = '0'
+    workdir = tempfile.mkdtemp(prefix='wea-bench-')
+    try:
+        # caches private to the run, figures always rebuilt
+        app.store = DatasetStore(backend=FileBackend(os.path.join(workdir, 'datasets')))
+        app.figures = FigureCache(max_bytes=0)
+        zip_table()  # loaded once per process, not part of any step
+
+        results, inputs = [], []
+        for n_rows in [int(s) for s in args.sizes.split(',')]:
+            size_results, csv_bytes = bench_size(n_rows, args.repeat, workdir)
+            results.extend(size_results)
+            inputs.append({'rows': n_rows, 'csv_bytes': csv_bytes})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'pandas': pd.__version__,
+                              'numpy': np.__version__,
+                              'plotly': plotly.__version__},
+              'repeat': args.repeat,
+              'inputs': inputs,
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('results written to %s' % args.out)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
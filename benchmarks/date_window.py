@@ -0,0 +1,52 @@
+"""Benchmark of date range filtering on a large synthetic export.
+
+Compares the old way of filtering (a boolean mask over the whole frame per
+window) with StoreDataset.between, which binary searches the date-sorted
+tables and slices them.
+
+Usage: python benchmarks/date_window.py [n_rows]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+
+from analytics import StoreDataset
+from ingest import normalize_orders
+from synthetic import generate_export
+
+
+def main(n_rows=1000000, repeat=5):
+    print('generating %d line items...' % n_rows)
+    ds = StoreDataset.from_items(normalize_orders(generate_export(n_rows)))
+    items, orders = ds.items, ds.orders
+
+    # the date picker range plus the All/1m/3m/1yr windows of
+    # revenue_table, dollars_histogram and orders_histogram
+    end = orders['Date'].max()
+    starts = [orders['Date'].min()] + \
+             [end - pd.Timedelta(days=d) for d in (30, 91, 364)] * 3 + \
+             [end - pd.Timedelta(days=d) for d in (30, 91, 364)]
+
+    def masked():
+        for start in starts:
+            items.loc[(items['Date'] >= start) & (items['Date'] <= end)]
+            orders.loc[(orders['Date'] >= start) & (orders['Date'] <= end)]
+
+    def sliced():
+        for start in starts:
+            ds.between(start, end)
+
+    t_mask = min(timeit.repeat(masked, number=1, repeat=repeat))
+    t_slice = min(timeit.repeat(sliced, number=1, repeat=repeat))
+    print('%d windows over %d items / %d orders' % (len(starts), len(items), len(orders)))
+    print('boolean masks:   %8.2f ms' % (t_mask * 1000))
+    print('binary search:   %8.2f ms' % (t_slice * 1000))
+    print('speedup:         %8.1fx' % (t_mask / t_slice))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
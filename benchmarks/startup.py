@@ -0,0 +1,135 @@
+"""Benchmark of cold start: from a new process to the first answered views.
+
+Every run is a fresh Python process (best of --repeat runs per scenario):
+
+  import        importing app.py (what gunicorn does before serving)
+  warm_up       the steps of warmup.warm_up (zip codes, genders, plotly)
+  first views   an upload of a small synthetic export and the first sales
+                and customer callbacks, in a process that is
+                  cold - just imported, as a worker without warm-up
+                  warm - warmed up first, as a worker forked from a
+                         preloaded gunicorn master (see gunicorn.conf.py)
+
+Results are written as JSON, like benchmarks/callbacks.py.
+
+Usage: python benchmarks/startup.py [--repeat 3] [--rows 2000]
+           [--out startup.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# Output: dict of step -> seconds of one fresh process (runs in the child)
+# Input:  scenario: 'cold' or 'warm'
+#         n_rows: line items of the uploaded export
+def child(scenario, n_rows):
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    seconds = {}
+
+    start = time.perf_counter()
+    import app
+    seconds['import'] = time.perf_counter() - start
+
+    import warmup
+    from datastore import DatasetStore
+    from figcache import FigureCache
+    from parsecache import ParsedCache
+    from sharedcache import FileBackend
+    from synthetic import generate_export
+
+    workdir = tempfile.mkdtemp(prefix='wea-startup-')
+    try:
+        app.store = DatasetStore(backend=FileBackend(os.path.join(workdir, 'datasets')))
+        app.figures = FigureCache(max_bytes=0)
+        app.parsed = ParsedCache(os.path.join(workdir, 'parsed'))
+        csv = generate_export(n_rows).to_csv(index=False).encode('utf-8')
+        contents = 'data:text/csv;base64,' + base64.b64encode(csv).decode('ascii')
+
+        if scenario == 'warm':
+            warmup.warm_up()
+            for name, step_seconds in warmup.status()['seconds'].items():
+                seconds['warm_up: %s' % name] = step_seconds
+
+        def timed(step, run):
+            start = time.perf_counter()
+            result = run()
+            seconds[step] = time.perf_counter() - start
+            return result
+
+        def callback(name):
+            return getattr(app, name).__wrapped__
+
+        first = time.perf_counter()
+        job_id = timed('parse_file', lambda: callback('parse_file')(
+            contents, 'orders.csv', [], None))
+        dataset_id = callback('poll_upload')(job_id, None)[0]
+        _, _, begin, end = callback('setup_date_range')(dataset_id)
+        fingerprint = callback('update_filter')(str(begin)[:10], str(end)[:10], dataset_id)
+        timed('update_sales_graph', lambda: callback('update_sales_graph')([], 'Monthly', fingerprint))
+        timed('update_sales_maps', lambda: callback('update_sales_maps')(fingerprint))
+        timed('update_revenue_table', lambda: callback('update_revenue_table')(fingerprint))
+        timed('update_customer_indicators',
+              lambda: callback('update_customer_indicators')(fingerprint))
+        timed('update_dollars_histogram', lambda: callback('update_dollars_histogram')(fingerprint))
+        seconds['first views'] = time.perf_counter() - first
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return seconds
+
+
+# Output: dict of step -> best seconds over repeat fresh processes
+def run_scenario(scenario, repeat, n_rows):
+    best = {}
+    # upload jobs run in the measured process (see jobs.py)
+    env = dict(os.environ, WEA_METRICS_LOG='0', WEA_JOB_WORKERS='0')
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', scenario,
+             '--rows', str(n_rows)], env=env, stderr=subprocess.DEVNULL)
+        for step, seconds in json.loads(out.decode('utf-8').splitlines()[-1]).items():
+            best[step] = min(best.get(step, seconds), seconds)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3, help='processes per scenario')
+    parser.add_argument('--rows', type=int, default=2000, help='line items of the upload')
+    parser.add_argument('--out', default='startup_results.json', help='JSON results file')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child, args.rows)))
+        return
+
+    results = []
+    for scenario in ('cold', 'warm'):
+        for step, seconds in run_scenario(scenario, args.repeat, args.rows).items():
+            results.append({'scenario': scenario, 'step': step, 'seconds': round(seconds, 6)})
+            print('%-5s %-34s %8.3fs' % (scenario, step, seconds))
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform()},
+              'repeat': args.repeat,
+              'rows': args.rows,
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('results written to %s' % args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Synthetic Weebly order exports for benchmarking.
+
+Generates dataframes laid out like the CSV that Weebly's "Export Orders"
+produces: one row per line item, with the order-level fields (subtotal,
+shipping, coupon, customer details) only on the first line of every order.
+
+Usage: python benchmarks/synthetic.py n_rows out.csv
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+
+# common US first names, so the gender indicator has something to guess
+FIRST_NAMES = ['Mary', 'Patricia', 'Jennifer', 'Linda', 'Elizabeth', 'Susan',
+               'Jessica', 'Sarah', 'Karen', 'Emily', 'Ashley', 'Megan',
+               'James', 'John', 'Robert', 'Michael', 'William', 'David',
+               'Richard', 'Joseph', 'Thomas', 'Daniel', 'Matthew', 'Ryan',
+               'Alex', 'Jordan', 'Taylor', 'Casey', 'Kim', 'Robin']
+
+
+# Output: df: pandas dataframe with the columns of a raw Weebly export
+# Input:  n_rows: approximate number of line items to generate
+#         n_products: number of distinct products (SKUs)
+#         n_customers: number of distinct customers (shipping emails),
+#                      ignored if repeat_rate is given
+#         days: number of days the orders are spread over
+#         seed: random seed, the same arguments always give the same data
+#         items_per_order: (min, max) number of line items of an order
+#         repeat_rate: share of orders placed by a customer who already
+#                      ordered (default: from n_customers)
+#         zipcodes: 'uniform' for any 5 digit number, 'us' for real US zip
+#                   codes with a few busy ones (needs the uszipcode data,
+#                   see geocode.py)
+def generate_export(n_rows=100000, n_products=50, n_customers=None,
+                    days=3*365, seed=0, items_per_order=(1, 3),
+                    repeat_rate=None, zipcodes='uniform'):
+    rng = np.random.RandomState(seed)
+    lo, hi = items_per_order
+    n_orders = max(1, int(n_rows // ((lo + hi) / 2.0)))
+    if repeat_rate is None:
+        if n_customers is None:
+            n_customers = max(1, n_orders // 3)
+        repeat_rate = 1 - min(n_customers, n_orders) / float(n_orders)
+
+    # lo-hi line items per order, trimmed to n_rows
+    lines = rng.randint(lo, hi + 1, n_orders)
+    order_idx = np.repeat(np.arange(n_orders), lines)[:n_rows]
+    first = np.r_[True, order_idx[1:] != order_idx[:-1]]
+
+    start = pd.Timestamp('2016-01-01')
+    order_dates = start + pd.to_timedelta(np.sort(rng.randint(0, days * 24 * 60, n_orders)), unit='m')
+    customer = order_customers(rng, n_orders, repeat_rate)
+    n_customers = customer.max() + 1
+    product = popular_choice(rng, n_products, len(order_idx))
+    quantity = rng.randint(1, 4, len(order_idx))
+    price = np.round(rng.uniform(5, 80, n_products), 2)
+    line_total = np.round(quantity * price[product], 2)
+    subtotal = np.bincount(order_idx, weights=line_total)
+    zips = customer_zipcodes(rng, n_customers, zipcodes)
+
+    def order_level(values):
+        out = pd.Series(values[order_idx])
+        return out.where(first)
+
+    first_names = np.array(FIRST_NAMES)[rng.randint(0, len(FIRST_NAMES), n_customers)]
+    df = pd.DataFrame({
+        'Order #': 10000 + order_idx,
+        'Date': np.asarray(order_dates.strftime('%m/%d/%Y %H:%M'))[order_idx],
+        'Subtotal': order_level(np.round(subtotal, 2)),
+        'Shipping Price': order_level(np.where(subtotal > 75, 0.0, 6.5)),
+        'Coupon': order_level(np.where(rng.rand(n_orders) < 0.15, 'SAVE10', None)),
+        'Product Name': pd.Series(np.array(['Product %d' % i for i in range(n_products)])[product]),
+        'Product Quantity': quantity,
+        'Product Price': price[product],
+        'Product Total Price': line_total,
+        'Shipping First Name': order_level(first_names[customer]),
+        'Shipping Last Name': order_level(np.array(['Last%d' % c for c in range(n_customers)])[customer]),
+        'Shipping Email': order_level(np.array(['customer%d@example.com' % c for c in range(n_customers)])[customer]),
+        'Shipping City': order_level(np.array(['city %d' % (z % 997) for z in zips])[customer]),
+        'Shipping Region': order_level(np.array(['ST%d' % (z % 50) for z in zips])[customer]),
+        'Shipping Postal Code': order_level(zips[customer].astype(float)),
+    })
+    return df
+
+
+# Output: int array of the customer (0..n_customers-1) of every order, in
+#         order of first purchase
+# Input:  rng: numpy RandomState
+#         n_orders: number of orders
+#         repeat_rate: share of orders by a customer who already ordered
+def order_customers(rng, n_orders, repeat_rate):
+    repeat = rng.rand(n_orders) < repeat_rate
+    repeat[0] = False
+    # a repeat order copies the customer of a random earlier order, so
+    # customers who bought often are more likely to buy again
+    parent = np.arange(n_orders)
+    parent[repeat] = (rng.rand(repeat.sum()) * np.flatnonzero(repeat)).astype(np.int64)
+    while True:  # follow the copies back to the first order of each customer
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            break
+        parent = grandparent
+    new_ids = np.cumsum(~repeat) - 1
+    return new_ids[parent]
+
+
+# Output: int array of n indices in 0..n_choices-1, a few of them much more
+#         frequent than the others (Zipf-like, as product and zip sales are)
+def popular_choice(rng, n_choices, n):
+    weights = 1.0 / np.arange(1, n_choices + 1)
+    ranks = rng.choice(n_choices, n, p=weights / weights.sum())
+    return rng.permutation(n_choices)[ranks]
+
+
+# Output: int array of a zip code per customer
+# Input:  rng: numpy RandomState
+#         n_customers: number of customers
+#         zipcodes: 'uniform' or 'us', see generate_export
+def customer_zipcodes(rng, n_customers, zipcodes='uniform'):
+    if zipcodes == 'uniform':
+        return rng.randint(1000, 99951, n_customers)
+    if zipcodes != 'us':
+        raise ValueError('unknown zip code distribution %r' % zipcodes)
+    from geocode import zip_table
+    known = np.flatnonzero(~np.isnan(zip_table()[0]))
+    return known[popular_choice(rng, len(known), n_customers)]
+
+
+if __name__ == '__main__':
+    generate_export(int(sys.argv[1]), zipcodes='us').to_csv(sys.argv[2], index=False)
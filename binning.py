@@ -0,0 +1,62 @@
+"""Server-side histogram binning for the customer charts.
+
+Rather than shipping every per-order or per-customer value to the browser and
+letting plotly.js bin them, the histograms are counted here with NumPy and
+drawn as bar traces, so the figure size depends on the number of bins only.
+All windows (All/1m/3m/1yr) of a chart share the same bin edges so switching
+between them keeps the x axis in place.
+"""
+import numpy as np
+
+MAX_BINS = 60
+
+
+# Output: a "round" bin width (1, 2, 2.5 or 5 times a power of 10) that
+#         splits span into at most max_bins bins
+# Input:  span: width of the range of values
+#         max_bins: upper bound on the number of bins
+def nice_width(span, max_bins=MAX_BINS):
+    raw = float(span) / max_bins
+    if not raw > 0:
+        return 1.0
+    magnitude = 10 ** np.floor(np.log10(raw))
+    for step in (1, 2, 2.5, 5):
+        if raw <= step * magnitude:
+            return step * magnitude
+    return 10 * magnitude
+
+
+# Output: array of bin edges covering the values of all the arrays
+# Input:  arrays: list of arrays/series of values (NaN is ignored)
+#         integer: True for integer counts, bins are then whole numbers
+#                  centered on the integers
+#         max_bins: upper bound on the number of bins
+def shared_edges(arrays, integer=False, max_bins=MAX_BINS):
+    values = [finite(a) for a in arrays]
+    values = [v for v in values if len(v)]
+    if not values:
+        return np.array([0.0, 1.0])
+    lo = min(v.min() for v in values)
+    hi = max(v.max() for v in values)
+
+    if integer:
+        width = float(np.ceil(nice_width(hi - lo + 1, max_bins)))
+        start = lo - 0.5
+    else:
+        width = nice_width(hi - lo, max_bins)
+        start = np.floor(lo / width) * width
+    n_bins = int(np.floor((hi - start) / width)) + 1
+    return start + width * np.arange(n_bins + 1)
+
+
+# Output: array of the number of values in every bin
+# Input:  values: array/series of values (NaN is ignored)
+#         edges: bin edges, see shared_edges
+def bin_counts(values, edges):
+    return np.histogram(finite(values), bins=edges)[0]
+
+
+# Output: float array of the finite values
+def finite(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values[np.isfinite(values)]
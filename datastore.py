@@ -0,0 +1,93 @@
+"""Server-side store for parsed order datasets.
+
+Instead of round-tripping the whole orders DataFrame through hidden divs in
+the browser, callbacks keep datasets here and only pass around an opaque
+dataset ID. Datasets are pickled into a cache backend shared by all workers
+(see sharedcache.py), so any worker can serve any session, and the most
+recently used ones are also kept deserialized in a small in-memory LRU. They
+are dropped once their TTL runs out.
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from metrics import stage
+from sharedcache import backend_from_env
+
+
+class DatasetStore(object):
+
+    # Input:  backend: shared cache backend for the pickled datasets
+    #                  (default: see sharedcache.backend_from_env)
+    #         max_items: number of datasets kept deserialized in memory
+    #         ttl: seconds since last access after which a dataset is dropped
+    def __init__(self, backend=None, max_items=8, ttl=60*60):
+        self.backend = backend or backend_from_env('wea-datasets', ttl=ttl)
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> dataset, most recent last
+        self._last_access = {}       # key -> timestamp
+        self._lock = threading.RLock()
+
+    # Output: key: opaque string ID to hand to the browser
+    # Input:  data: any picklable object (usually a pandas dataframe)
+    #         key: optional ID to store the data under (new random ID if None)
+    def put(self, data, key=None):
+        if key is None:
+            key = uuid.uuid4().hex
+        self.backend.set(key, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._remember(key, data)
+        self.evict_expired()
+        return key
+
+    # Output: the stored object, or None if unknown/expired
+    # Input:  key: ID returned by put()
+    def get(self, key):
+        if not key:
+            return None
+        with self._lock:
+            if key in self._items:
+                self._remember(key, self._items[key])
+                self.backend.touch(key)  # other workers may need it later
+                return self._items[key]
+        raw = self.backend.get(key)  # put by this or another worker
+        if raw is None:
+            return None
+        try:
+            with stage('deserialize') as loading:
+                loading.bytes = len(raw)
+                data = pickle.loads(raw)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    # Drops datasets (memory and backend) not accessed within the TTL
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for key in [k for k, t in self._last_access.items() if t < cutoff]:
+                self._items.pop(key, None)
+                del self._last_access[key]
+        self.backend.evict(max_age=self.ttl)
+
+    def _remember(self, key, data):
+        self._items[key] = data
+        self._items.move_to_end(key)
+        self._last_access[key] = time.time()
+        while len(self._items) > self.max_items:
+            # still in the backend, so get() can bring it back
+            self._items.popitem(last=False)
+
+
+# Output: short string identifying a (dataset, date range) combination
+# Input:  dataset_id: ID of the unfiltered dataset in the store
+#         start_date, end_date: the date range strings used for filtering
+def filter_fingerprint(dataset_id, start_date, end_date):
+    raw = '%s|%s|%s' % (dataset_id, start_date, end_date)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
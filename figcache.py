@@ -0,0 +1,120 @@
+"""Cache of serialized Plotly figures.
+
+Figures are keyed by everything that determines them (which figure, the
+filter fingerprint of the dataset and date range, view options) and kept as
+JSON strings, so a repeated view skips building and validating the figure.
+The cache is bounded by the total size of the JSON it holds and evicts the
+least recently used figures first.
+
+With a shared backend (see sharedcache.py) built figures are also published
+to the other workers, and a figure being built by one worker is waited for
+rather than built again by the others.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import plotly
+
+from metrics import stage
+
+
+class FigureCache(object):
+
+    # Input:  max_bytes: upper bound on the total size of the cached JSON
+    #                    held in this process
+    #         backend: optional shared cache backend
+    #         shared_bytes: upper bound on the JSON held by the backend
+    #         ttl: seconds a figure stays in the backend after last access
+    def __init__(self, max_bytes=64*1024*1024, backend=None,
+                 shared_bytes=256*1024*1024, ttl=60*60):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.shared_bytes = shared_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()  # key -> JSON string, most recent last
+        self._lock = threading.Lock()
+
+    # Output: the figure(s) as plain JSON-compatible objects, from the cache
+    #         if possible, otherwise built and added to the cache
+    # Input:  key: hashable tuple identifying the figure
+    #         build: function without arguments that builds the figure(s),
+    #                returning None (not cached) if they can't be built
+    def get_or_build(self, key, build):
+        with self._lock:
+            serialized = self._figures.get(key)
+            if serialized is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if serialized is None:
+            serialized = self._build(key, build)
+            if serialized is None:
+                return None
+        with stage('deserialize') as loading:
+            loading.bytes = len(serialized)
+            return json.loads(serialized)
+
+    # Output: dict of hit/miss counters and current size
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'shared_hits': self.shared_hits,
+                    'misses': self.misses,
+                    'figures': len(self._figures), 'bytes': self.nbytes}
+
+    # Output: JSON of the figure from the backend or built, None if it can't
+    #         be built
+    def _build(self, key, build):
+        if self.backend is None:
+            return self._serialize(key, build)
+        name = repr(key)
+        serialized = self._shared(key, name)
+        if serialized is not None:
+            return serialized
+        with self.backend.lock(name):
+            serialized = self._shared(key, name)  # built while we waited?
+            if serialized is not None:
+                return serialized
+            serialized = self._serialize(key, build)
+            if serialized is not None:
+                self.backend.set(name, serialized.encode('utf-8'))
+        self.backend.evict(max_age=self.ttl, max_bytes=self.shared_bytes)
+        return serialized
+
+    def _shared(self, key, name):
+        raw = self.backend.get(name)
+        if raw is None:
+            return None
+        serialized = raw.decode('utf-8')
+        with self._lock:
+            self.shared_hits += 1
+        self._put(key, serialized)
+        return serialized
+
+    def _serialize(self, key, build):
+        figure = build()
+        if figure is None:
+            return None
+        with stage('serialize') as encoding:
+            serialized = json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder)
+            encoding.bytes = len(serialized)
+        self._put(key, serialized)
+        return serialized
+
+    def _put(self, key, serialized):
+        size = len(serialized)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._figures:
+                self.nbytes -= len(self._figures.pop(key))
+            self._figures[key] = serialized
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._figures.popitem(last=False)
+                self.nbytes -= len(evicted)
@@ -0,0 +1,46 @@
+"""First name -> gender inference for the customer indicators.
+
+gender_guesser parses its whole name dictionary whenever a Detector is
+created, so one Detector is shared per process and every name is only looked
+up once (memoized). Datasets get their customers' genders computed once at
+ingestion, from the unique first names only.
+"""
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from metrics import timed
+
+_detector = None
+_lock = threading.Lock()
+
+
+# Output: the process-wide gender_guesser Detector
+def detector():
+    global _detector
+    if _detector is None:
+        with _lock:
+            if _detector is None:
+                import gender_guesser.detector
+                _detector = gender_guesser.detector.Detector()
+    return _detector
+
+
+# Output: gender_guesser result ('female', 'mostly_female', 'male',
+#         'mostly_male', 'andy' or 'unknown')
+# Input:  first_name: string, any capitalization
+@lru_cache(maxsize=None)
+def guess_gender(first_name):
+    return detector().get_gender(first_name.lower().capitalize())
+
+
+# Output: categorical series of guessed genders (NaN where no first name)
+# Input:  first_names: categorical series of first names
+@timed('genders', rows=lambda first_names: len(first_names.cat.categories))
+def infer_genders(first_names):
+    labels = [guess_gender(str(name)) for name in first_names.cat.categories]
+    labels = np.array(labels + [None], dtype=object)  # code -1 -> None
+    return pd.Series(labels[first_names.cat.codes.values],
+                     index=first_names.index).astype('category')
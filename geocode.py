@@ -0,0 +1,72 @@
+"""Zip code -> (latitude, longitude) lookup for the sales maps.
+
+The uszipcode SQLite database is read once per process into two NumPy arrays
+indexed by the 5 digit zip code, so resolving a whole column of zip codes is a
+single vectorized take instead of one SQL query per row. The arrays are also
+saved next to the other caches (in the private cache directory, see
+sharedcache.py), so later processes skip the database.
+"""
+import os
+import threading
+
+import numpy as np
+
+from metrics import timed
+from sharedcache import cache_dir
+
+CACHE_NAME = 'wea-zipcodes'  # directory of the cached arrays, see cache_dir
+N_ZIPCODES = 100000
+
+_table = None
+_lock = threading.Lock()
+
+
+# Output: (lat, lng) arrays of length N_ZIPCODES, NaN for unknown zip codes
+def zip_table():
+    global _table
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table = _load_table()
+    return _table
+
+
+def _load_table():
+    cache_file = os.path.join(cache_dir(CACHE_NAME), 'zipcodes.npz')
+    try:
+        with np.load(cache_file, allow_pickle=False) as cached:
+            return cached['lat'], cached['lng']
+    except (IOError, OSError, KeyError, ValueError):
+        pass
+
+    from uszipcode import SearchEngine, SimpleZipcode
+    search = SearchEngine(simple_zipcode=True)
+    rows = search.ses.query(SimpleZipcode.zipcode,
+                            SimpleZipcode.lat, SimpleZipcode.lng).all()
+    lat = np.full(N_ZIPCODES, np.nan)
+    lng = np.full(N_ZIPCODES, np.nan)
+    for zipcode, zip_lat, zip_lng in rows:
+        if zipcode.isdigit() and zip_lat is not None and zip_lng is not None:
+            lat[int(zipcode)] = zip_lat
+            lng[int(zipcode)] = zip_lng
+
+    tmp = '%s.%d.tmp.npz' % (cache_file[:-len('.npz')], os.getpid())
+    try:
+        np.savez(tmp, lat=lat, lng=lng)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
+    return lat, lng
+
+
+# Output: (lat, lng) float arrays, NaN where the zip code is unknown/missing
+# Input:  zipcodes: series/array of numeric zip codes (may contain NaN)
+@timed('geocode', rows=len)
+def zip_coordinates(zipcodes):
+    lat_table, lng_table = zip_table()
+    zips = np.asarray(zipcodes.astype(np.float64))
+    valid = (zips >= 0) & (zips < N_ZIPCODES)  # False for NaN too
+    idx = np.where(valid, zips, 0).astype(np.int64)
+    lat = np.where(valid, lat_table[idx], np.nan)
+    lng = np.where(valid, lng_table[idx], np.nan)
+    return lat, lng
@@ -0,0 +1,19 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py app:server
+
+app.py is imported and warmed up (see warmup.py) once in the master, before
+the workers are forked, so every worker starts with the zip code table, the
+gender name table and Plotly's templates already loaded and shares that
+memory with the others.
+"""
+preload_app = True
+threads = 4
+
+
+def when_ready(server):
+    import warmup
+    warmup.warm_up()
+
+
+def post_fork(server, worker):
+    import warmup
+    warmup.start()  # nothing to do if the master warmed up
@@ -0,0 +1,101 @@
+"""Streaming ingestion of Weebly order exports.
+
+Uploads arrive from dcc.Upload as one big base64 data URL. Rather than
+decoding it into bytes, then a str, then a StringIO, the payload is decoded
+piecewise into a temporary file and parsed from there in chunks, keeping only
+the columns the dashboard uses.
+"""
+import base64
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+
+from metrics import stage
+from schema import SCHEMA_VERSION, apply_schema, concat_chunks
+
+# Columns of the Weebly export used by the dashboard, with their types.
+# Order-level columns (Subtotal, Shipping ..., Coupon) are only filled in on the
+# first line item of every order, so they have to be NaN-friendly.
+WEEBLY_DTYPES = {
+    'Order #': 'int64',
+    'Date': 'object',
+    'Subtotal': 'float64',
+    'Shipping Price': 'float64',
+    'Coupon': 'object',
+    'Product Name': 'object',
+    'Product Quantity': 'float64',
+    'Product Total Price': 'float64',
+    'Shipping First Name': 'object',
+    'Shipping Last Name': 'object',
+    'Shipping Email': 'object',
+    'Shipping City': 'object',
+    'Shipping Region': 'object',
+    'Shipping Postal Code': 'object',  # ZIP+4 and foreign codes, see schema.py
+}
+
+CHUNK_ROWS = 50000
+B64_CHUNK = 4 * 256 * 1024  # multiple of 4 so every slice decodes on its own
+
+
+# Output: temporary binary file holding the decoded upload, rewound to start
+# Input:  contents: data URL string from dcc.Upload ('data:...;base64,....')
+def decode_upload(contents):
+    start = contents.index(',') + 1
+    f = tempfile.TemporaryFile()
+    for i in range(start, len(contents), B64_CHUNK):
+        f.write(base64.b64decode(contents[i:i + B64_CHUNK]))
+    f.seek(0)
+    return f
+
+
+# Output: hex digest identifying the uploaded file's contents and type, and
+#         the schema it is parsed into (old parses aren't reused)
+# Input:  contents: data URL string from dcc.Upload
+#         filename: name of the uploaded file
+def upload_hash(contents, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    h = hashlib.sha1(('%d%s' % (SCHEMA_VERSION, ext)).encode('utf-8'))
+    start = contents.index(',') + 1
+    for i in range(start, len(contents), B64_CHUNK):
+        h.update(contents[i:i + B64_CHUNK].encode('ascii'))
+    return h.hexdigest()
+
+
+# Output: df: chunk with parsed dates, normalized customer fields and
+#             compact column types (see schema.py)
+# Input:  df: raw chunk of the Weebly export
+def normalize_orders(df):
+    df['Date'] = pd.to_datetime(df['Date']).dt.normalize() # drop time of day
+    df['Shipping Email'] = df['Shipping Email'].str.lower()
+    df['Shipping City'] = df['Shipping City'].str.title()
+    df = df.rename(columns={"Product Total Price": "Sales ($)"})
+    return apply_schema(df)
+
+
+# Output: df: pandas dataframe of all line items in the export
+# Input:  contents: data URL string from dcc.Upload
+#         filename: name of the uploaded file (decides between csv/excel)
+#         progress: optional function called with the # of rows parsed and
+#                   the share of the file read after every CSV chunk
+def read_orders(contents, filename, progress=None):
+    with stage('parse') as parsing, decode_upload(contents) as f:
+        parsing.bytes = len(contents)
+        if 'csv' in filename:
+            size = max(os.fstat(f.fileno()).st_size, 1)
+            chunks = pd.read_csv(f, usecols=lambda c: c in WEEBLY_DTYPES,
+                                 dtype=WEEBLY_DTYPES, chunksize=CHUNK_ROWS)
+            parts, rows = [], 0
+            for chunk in chunks:
+                parts.append(normalize_orders(chunk))
+                rows += len(chunk)
+                if progress is not None:
+                    progress(rows, min(f.tell() / float(size), 1.0))
+            df = concat_chunks(parts)
+        elif 'xls' in filename:
+            df = normalize_orders(pd.read_excel(f))
+        else:
+            raise ValueError('Not a CSV or excel file.')
+        parsing.rows = len(df)
+        return df
@@ -0,0 +1,221 @@
+"""Background ingestion of uploads.
+
+Parsing a large export and precomputing its StoreDataset can take far longer
+than a web request should hold a gunicorn worker, so an upload is a job:
+
+  submit()  queues the job in a pool of processes started by the web worker
+            (WEA_JOB_WORKERS of them, default 1; 0 runs jobs in the calling
+            thread) and returns the job ID right away
+  run_job   parses the upload (see ParsedCache.read_orders), builds the
+            StoreDataset or appends to the current one and puts it in the
+            DatasetStore, writing its progress (stage, rows parsed, share of
+            the file read) as it goes
+  status()  reads that progress, from any web worker
+
+Job progress and the resulting dataset are kept in the shared cache backends
+(see sharedcache.py), so whichever worker the browser's next request lands on
+sees them. The browser polls status() with a dcc.Interval (see poll_upload in
+app.py) and gets the dataset ID once the job is done, which fills in the
+figures. Jobs run in processes rather than threads so that parsing doesn't
+hold the GIL of the worker serving other users.
+"""
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import timed_job
+from sharedcache import backend_from_env
+
+JOB_TTL = 60*60             # seconds a finished job's status is kept
+PROGRESS_INTERVAL = 0.25    # seconds between progress writes within a stage
+STAGES = [('parse', 'Reading'), ('aggregate', 'Computing totals of'),
+          ('save', 'Saving')]
+
+_backend = None
+_pool = None
+_lock = threading.Lock()
+_defaults = {}  # DatasetStore/ParsedCache of job processes, made on first use
+
+
+# Output: the shared backend holding the job statuses
+def backend():
+    global _backend
+    if _backend is None:
+        _backend = backend_from_env('wea-jobs', ttl=JOB_TTL)
+    return _backend
+
+
+# Output: job ID (string) of the upload's ingestion, queued or (without job
+#         processes) already run
+# Input:  contents: data URL string from dcc.Upload
+#         filename: name of the uploaded file
+#         base_id: ID of the dataset to append the upload to, None for a
+#                  new dataset
+#         store, parsed: DatasetStore and ParsedCache for jobs run in this
+#                        thread (job processes use their own, on the same
+#                        shared backends)
+def submit(contents, filename, base_id=None, store=None, parsed=None):
+    job_id = uuid.uuid4().hex
+    write_status(job_id, {'state': 'queued', 'filename': filename})
+    backend().evict(max_age=JOB_TTL)
+
+    pool = executor()
+    if pool is None:
+        run_job(job_id, contents, filename, base_id, store, parsed)
+        return job_id
+    try:
+        future = pool.submit(run_job, job_id, contents, filename, base_id)
+    except RuntimeError:  # pool broken (e.g. a job process was killed)
+        reset_executor(pool)
+        future = executor().submit(run_job, job_id, contents, filename, base_id)
+    future.add_done_callback(lambda f: check_job(job_id, filename, f, pool))
+    return job_id
+
+
+# Output: dict of the job's status (see JobProgress), None if unknown or
+#         expired
+def status(job_id):
+    if not job_id:
+        return None
+    raw = backend().get(job_id)
+    return json.loads(raw.decode('utf-8')) if raw is not None else None
+
+
+# Output: the process pool running the jobs, None if jobs run in the
+#         calling thread (WEA_JOB_WORKERS=0)
+def executor():
+    global _pool
+    n_workers = int(os.environ.get('WEA_JOB_WORKERS', '1'))
+    if n_workers <= 0:
+        return None
+    with _lock:
+        if _pool is None:
+            # spawned, not forked: the web worker has threads (and maybe
+            # locks held by them) that a fork would copy mid-flight
+            _pool = ProcessPoolExecutor(n_workers,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def reset_executor(broken):
+    global _pool
+    with _lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+# Marks the job failed if its process died without reporting (run_job
+# reports its own errors)
+def check_job(job_id, filename, future, pool):
+    if future.cancelled() or future.exception() is not None:
+        current = status(job_id) or {}
+        if current.get('state') not in ('done', 'error'):
+            write_status(job_id, {'state': 'error', 'filename': filename,
+                                  'message': 'The upload could not be processed.'})
+        if not future.cancelled():
+            reset_executor(pool)
+
+
+def write_status(job_id, record):
+    record['updated'] = time.time()
+    backend().set(job_id, json.dumps(record).encode('utf-8'))
+
+
+class JobProgress(object):
+
+    # Input:  job_id: ID of the job whose status this writes
+    #         filename: name of the uploaded file
+    def __init__(self, job_id, filename):
+        self.job_id = job_id
+        self.record = {'state': 'running', 'filename': filename, 'stage': None,
+                       'rows': 0, 'fraction': 0.0, 'stages_done': []}
+        self._stage_start = None
+        self._last_write = 0
+
+    # Ends the current stage (if any) and starts the stage name
+    def stage(self, name):
+        now = time.time()
+        if self.record['stage'] is not None:
+            self.record['stages_done'].append(
+                [self.record['stage'], round(now - self._stage_start, 3)])
+        self.record['stage'] = name
+        self._stage_start = now
+        self._write()
+
+    # Records parsing progress (called after every chunk, see ingest.py)
+    # Input:  rows: # of line items parsed so far
+    #         fraction: share of the file read so far
+    def parsed(self, rows, fraction):
+        self.record['rows'] = rows
+        self.record['fraction'] = round(fraction, 4)
+        if time.time() - self._last_write >= PROGRESS_INTERVAL:
+            self._write()
+
+    # Marks the job done
+    # Input:  dataset_id: ID of the resulting dataset in the DatasetStore
+    #         message: upload status shown to the user
+    def finish(self, dataset_id, message):
+        self.stage(None)
+        self.record.update(state='done', dataset=dataset_id, message=message,
+                           fraction=1.0)
+        self._write()
+
+    # Marks the job failed
+    def fail(self, message):
+        self.record.update(state='error', message=message)
+        self._write()
+
+    def _write(self):
+        self._last_write = time.time()
+        write_status(self.job_id, dict(self.record))
+
+
+# Parses the upload, builds (or appends) its StoreDataset and stores it,
+# reporting progress under job_id (runs in a job process, see submit)
+@timed_job
+def run_job(job_id, contents, filename, base_id=None, store=None, parsed=None):
+    from analytics import StoreDataset
+    store = store or default('store')
+    parsed = parsed or default('parsed')
+    progress = JobProgress(job_id, filename)
+    try:
+        progress.stage('parse')
+        df = parsed.read_orders(contents, filename, progress=progress.parsed)
+        progress.parsed(len(df), 1.0)
+
+        progress.stage('aggregate')
+        base = store.get(base_id) if base_id else None
+        if base_id and base is None:  # expired or evicted meanwhile
+            progress.fail('The data to add %s to is no longer available. '
+                          'Please re-upload the full export.' % filename)
+            return
+        if base is not None:
+            ds = base.append(df)
+            message = 'added %s (%d new orders)' % (filename, len(ds.orders) - len(base.orders))
+        else:
+            ds = StoreDataset.from_items(df)
+            message = 'uploaded %s' % filename
+        del df
+
+        progress.stage('save')
+        progress.finish(store.put(ds), message)
+    except Exception as e:
+        print(e)
+        progress.fail('There was an error processing this file. '
+                      'Please upload a proper CSV/excel file.')
+
+
+# Output: the process-wide DatasetStore ('store') or ParsedCache ('parsed')
+#         of job processes
+def default(name):
+    with _lock:
+        if name not in _defaults:
+            from datastore import DatasetStore
+            from parsecache import ParsedCache
+            _defaults[name] = DatasetStore() if name == 'store' else ParsedCache()
+        return _defaults[name]
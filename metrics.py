@@ -0,0 +1,514 @@
+"""Latency and memory instrumentation of the callbacks.
+
+Every Dash callback (see instrument_callbacks) and the internal stages it
+goes through are timed:
+
+  parse         reading an uploaded CSV/excel file (ingest.py)
+  deserialize   loading a cached dataset or parsed upload
+  filter        restricting a dataset to a date range
+  aggregate     the StoreDataset computations (analytics.py)
+  geocode       zip code -> coordinates (geocode.py)
+  genders       first name -> gender guesses (genders.py)
+  build_figure  turning aggregates into a Plotly figure (app.py)
+  serialize     packing and JSON encoding of figures
+
+Stages nest (a figure build aggregates, which filters), and each records its
+own time only, without the stages it called. A stage also records the rows
+it went through, the bytes it produced and how much the process memory grew
+meanwhile (traced Python allocations when tracemalloc is on, otherwise the
+resident set size).
+
+The numbers are served in Prometheus text format on /metrics and every
+callback writes one JSON log line (logger 'wea.metrics') with its stages.
+Upload jobs (jobs.run_job) are timed the same way, as callback run_job.
+Each worker publishes its numbers in a file next to the other caches, so
+/metrics shows all the workers of the machine (label worker=<pid>).
+Set WEA_METRICS_LOG=0 to turn the log lines off.
+
+The sampling profiler is off by default. /debug/profile?on=1 turns it on in
+every worker (within SNAPSHOT_INTERVAL seconds of their next callback),
+?off=1 turns it off again, and /debug/profile returns the stacks sampled by
+all the workers in the folded format of flamegraph.pl and speedscope.
+WEA_PROFILE=1 keeps it on from startup. Both /metrics and /debug/profile
+only answer local requests unless WEA_METRICS_PUBLIC=1.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from sharedcache import CACHE_ROOT, cache_dir
+
+SNAPSHOT_DIR = os.path.join(CACHE_ROOT, 'wea-metrics')
+SNAPSHOT_INTERVAL = 5      # seconds between snapshots of a busy worker
+SNAPSHOT_MAX_AGE = 60*60   # snapshots of workers gone for longer are ignored
+PROFILE_FLAG = os.path.join(SNAPSHOT_DIR, 'profile.on')
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# name -> (type, help) of every metric
+METRICS = {
+    'wea_callback_seconds': ('histogram', 'Time spent in a Dash callback.'),
+    'wea_callback_errors_total': ('counter', 'Dash callbacks that raised an exception.'),
+    'wea_callback_alloc_bytes_total': ('counter', 'Memory growth during Dash callbacks.'),
+    'wea_stage_seconds': ('histogram', 'Time spent in a stage, without the stages it called.'),
+    'wea_stage_rows_total': ('counter', 'Rows processed by a stage.'),
+    'wea_stage_bytes_total': ('counter', 'Bytes produced by a stage.'),
+    'wea_stage_alloc_bytes_total': ('counter', 'Memory growth during a stage.'),
+    'wea_response_seconds': ('histogram', 'Time to answer a callback request, JSON encoding included.'),
+    'wea_response_bytes_total': ('counter', 'Bytes of the callback responses.'),
+    'wea_figure_cache_total': ('counter', 'Figure cache lookups by result.'),
+    'wea_figure_cache_bytes': ('gauge', 'Size of the figures cached by the worker.'),
+    'wea_resident_bytes': ('gauge', 'Resident memory of the worker.'),
+}
+
+logger = logging.getLogger('wea.metrics')
+if os.environ.get('WEA_METRICS_LOG') != '0' and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+_local = threading.local()  # stack of running stages, current callback
+
+
+class Metrics(object):
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self._values = {}       # (name, labels) -> counter/gauge value
+        self._histograms = {}   # (name, labels) -> [bucket counts.., sum, count]
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._last_snapshot = 0
+
+    # Adds value to the counter name{labels}
+    # Input:  labels: tuple of (label, value) pairs
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            key = (name, labels)
+            self._values[key] = self._values.get(key, 0) + value
+
+    # Sets the gauge name{labels} to value
+    def set(self, name, labels, value):
+        with self._lock:
+            self._values[(name, labels)] = value
+
+    # Records value in the histogram name{labels}
+    def observe(self, name, labels, value):
+        with self._lock:
+            key = (name, labels)
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    # Registers a function without arguments that updates gauges/counters
+    # right before the metrics are read (e.g. from cache statistics)
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    # Output: JSON-compatible dict of all the values of this process
+    def snapshot(self):
+        for collect in self._collectors:
+            collect()
+        self.set('wea_resident_bytes', (), resident_bytes())
+        with self._lock:
+            return {'buckets': list(self.buckets),
+                    'values': [[n, list(l), v] for (n, l), v in self._values.items()],
+                    'histograms': [[n, list(l), h] for (n, l), h in self._histograms.items()]}
+
+    # Writes the snapshot (and profile) of this process for the other
+    # workers, at most every SNAPSHOT_INTERVAL seconds unless force, and
+    # starts/stops the profiler as toggled by /debug/profile
+    def publish(self, force=False):
+        now = time.time()
+        if not force and now - self._last_snapshot < SNAPSHOT_INTERVAL:
+            return
+        self._last_snapshot = now
+        base = os.path.join(SNAPSHOT_DIR, str(os.getpid()))
+        write_file(base + '.json', self.snapshot())
+        if PROFILER.running:
+            write_file(base + '.folded', dict(PROFILER.samples))
+        PROFILER.toggle(profiling_enabled())
+
+
+REGISTRY = Metrics()
+
+
+class Stage(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.bytes = None
+        self.children = 0.0  # seconds spent in nested stages
+        self.seconds = 0.0
+        self.alloc = 0
+
+
+# Context manager timing the stage name of the current callback. Set the
+# rows/bytes attributes of the yielded Stage to record them.
+@contextmanager
+def stage(name, rows=None):
+    current = Stage(name)
+    current.rows = rows
+    stack = _stack()
+    stack.append(current)
+    start_mem = allocated_bytes()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        elapsed = time.perf_counter() - start
+        current.alloc = max(allocated_bytes() - start_mem, 0)
+        stack.pop()
+        current.seconds = elapsed - current.children
+        if stack:
+            stack[-1].children += elapsed
+        record_stage(current)
+
+
+# Decorator timing every call of the function as the stage name
+# Input:  rows: optional function of the call's arguments giving the
+#         number of rows processed
+def timed(name, rows=None):
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, rows(*args, **kwargs) if rows else None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_stage(current):
+    callback = getattr(_local, 'callback', None)
+    labels = (('stage', current.name), ('callback', callback['name'] if callback else ''))
+    REGISTRY.observe('wea_stage_seconds', labels, current.seconds)
+    REGISTRY.inc('wea_stage_alloc_bytes_total', labels, current.alloc)
+    if current.rows is not None:
+        REGISTRY.inc('wea_stage_rows_total', labels, current.rows)
+    if current.bytes is not None:
+        REGISTRY.inc('wea_stage_bytes_total', labels, current.bytes)
+    if callback is not None:
+        totals = callback['stages'].setdefault(current.name, {'seconds': 0.0})
+        totals['seconds'] += current.seconds
+        for attr in ('rows', 'bytes'):
+            value = getattr(current, attr)
+            if value is not None:
+                totals[attr] = totals.get(attr, 0) + value
+
+
+# Output: the function timed as the Dash callback of that name
+# Input:  finish: function handed the record of every call (logs and
+#         publishes it, see finish_callback)
+def timed_callback(func, finish=None):
+    finish = finish or finish_callback
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        outer = getattr(_local, 'callback', None)
+        record = _local.callback = {'name': func.__name__, 'stages': {}}
+        labels = (('callback', func.__name__),)
+        start_mem = allocated_bytes()
+        start = time.perf_counter()
+        error = None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['alloc_bytes'] = max(allocated_bytes() - start_mem, 0)
+            _local.callback = outer
+            REGISTRY.observe('wea_callback_seconds', labels, record['seconds'])
+            REGISTRY.inc('wea_callback_alloc_bytes_total', labels, record['alloc_bytes'])
+            if error is not None and not is_prevented(error):
+                REGISTRY.inc('wea_callback_errors_total', labels)
+                record['error'] = repr(error)
+            finish(record)
+    return wrapper
+
+
+# Output: the function timed like a callback, for the upload jobs (see
+#         jobs.py), which run in processes serving no requests: their
+#         numbers are published as soon as the job is done
+def timed_job(func):
+    return timed_callback(func, finish=finish_job)
+
+
+def is_prevented(error):
+    return type(error).__name__ == 'PreventUpdate'
+
+
+# Logs the callback's record, after the response in a request (so the log
+# line has the response size), right away otherwise
+def finish_callback(record):
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        has_request_context = lambda: False
+    if has_request_context():
+        g.wea_callback = record
+    else:
+        log_callback(record)
+    REGISTRY.publish()
+
+
+def finish_job(record):
+    log_callback(record)
+    REGISTRY.publish(force=True)
+
+
+def log_callback(record):
+    record = dict(record, event='callback', seconds=round(record['seconds'], 6))
+    for totals in record['stages'].values():
+        totals['seconds'] = round(totals['seconds'], 6)
+    logger.info(json.dumps(record, sort_keys=True))
+
+
+# Times every callback registered with app.callback from now on
+# Input:  app: dash.Dash app
+def instrument_callbacks(app):
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        decorate = register(*args, **kwargs)
+        return lambda func: decorate(timed_callback(func))
+    app.callback = callback
+
+
+# Adds /metrics and /debug/profile to the Flask server, and the timing of
+# the callback responses
+# Input:  server: Flask app of the Dash app
+def add_endpoints(server):
+    from flask import Response, abort, g, request
+
+    def local_only():
+        if os.environ.get('WEA_METRICS_PUBLIC') != '1' and \
+                request.remote_addr not in LOCAL_ADDRESSES:
+            abort(404)
+
+    @server.before_request
+    def start_timer():
+        g.wea_start = time.perf_counter()
+
+    @server.after_request
+    def record_response(response):
+        if request.path.endswith('_dash-update-component'):
+            body = request.get_json(silent=True) or {}
+            labels = (('output', str(body.get('output', ''))),)
+            seconds = time.perf_counter() - g.wea_start
+            size = response.calculate_content_length() or 0
+            REGISTRY.observe('wea_response_seconds', labels, seconds)
+            REGISTRY.inc('wea_response_bytes_total', labels, size)
+            record = g.pop('wea_callback', None)
+            if record is not None:
+                record.update(output=labels[0][1], response_seconds=round(seconds, 6),
+                              response_bytes=size, status=response.status_code)
+                log_callback(record)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        local_only()
+        REGISTRY.publish(force=True)
+        return Response(render(read_snapshots()),
+                        mimetype='text/plain; version=0.0.4')
+
+    @server.route('/debug/profile')
+    def profile():
+        local_only()
+        if request.args.get('on') == '1':
+            write_file(PROFILE_FLAG, True)
+        elif request.args.get('off') == '1':
+            try:
+                os.remove(PROFILE_FLAG)
+            except OSError:
+                pass
+        REGISTRY.publish(force=True)
+        return Response(read_profiles(), mimetype='text/plain')
+
+
+# Writes value as JSON to path, atomically
+def write_file(path, value):
+    tmp = '%s.%d.tmp' % (path, threading.get_ident())
+    try:
+        cache_dir(os.path.basename(SNAPSHOT_DIR))
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+# Output: dict of worker pid -> JSON of its recent files with the extension
+def read_files(extension):
+    found = {}
+    cutoff = time.time() - SNAPSHOT_MAX_AGE
+    try:
+        names = os.listdir(SNAPSHOT_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if not name.endswith(extension):
+            continue
+        path = os.path.join(SNAPSHOT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                continue
+            with open(path) as f:
+                found[name[:-len(extension)]] = json.load(f)
+        except (IOError, OSError, ValueError):
+            continue
+    return found
+
+
+# Output: dict of worker pid -> snapshot of the workers of this machine
+def read_snapshots():
+    snapshots = read_files('.json')
+    snapshots[str(os.getpid())] = REGISTRY.snapshot()  # always fresh
+    return snapshots
+
+
+# Output: the stacks sampled by the workers of this machine, folded
+def read_profiles():
+    samples = Counter()
+    for worker_samples in read_files('.folded').values():
+        samples.update(worker_samples)
+    return ''.join('%s %d\n' % (s, n) for s, n in samples.most_common())
+
+
+def profiling_enabled():
+    return os.environ.get('WEA_PROFILE') == '1' or os.path.exists(PROFILE_FLAG)
+
+
+# Output: the snapshots in Prometheus text exposition format
+# Input:  snapshots: dict of worker -> Metrics.snapshot()
+def render(snapshots):
+    series = {}  # metric name -> lines
+    for worker, snap in sorted(snapshots.items()):
+        for name, labels, value in snap['values']:
+            series.setdefault(name, []).append(
+                '%s%s %s' % (name, format_labels(labels, worker), format_value(value)))
+        for name, labels, hist in snap['histograms']:
+            lines = series.setdefault(name, [])
+            for bound, count in zip(snap['buckets'] + ['+Inf'], hist[:-2] + [hist[-1]]):
+                lines.append('%s_bucket%s %d' % (
+                    name, format_labels(labels + [['le', str(bound)]], worker), count))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels, worker),
+                                          format_value(hist[-2])))
+            lines.append('%s_count%s %d' % (name, format_labels(labels, worker), hist[-1]))
+    out = []
+    for name in sorted(series):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        out.append('# HELP %s %s' % (name, help_text))
+        out.append('# TYPE %s %s' % (name, kind))
+        out.extend(series[name])
+    return '\n'.join(out) + '\n'
+
+
+def format_labels(labels, worker):
+    pairs = [('worker', worker)] + [tuple(pair) for pair in labels]
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in pairs)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Output: Int which is the memory used by the process: traced Python
+#         allocations if tracemalloc is on, otherwise the resident set size
+def allocated_bytes():
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[0]
+    return resident_bytes()
+
+
+# Output: Int which is the resident set size of the process (0 if unknown)
+def resident_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class SamplingProfiler(object):
+
+    # Input:  interval: seconds between samples of all threads' stacks
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()  # folded stack -> # of samples
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Starts sampling (from scratch) if on, stops if not
+    def toggle(self, on):
+        if on and not self.running:
+            self.samples = Counter()
+            self.running = True
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='wea-profiler')
+            self._thread.daemon = True
+            self._thread.start()
+        elif not on and self.running:
+            self._stop.set()
+            self._thread.join()
+            self.running = False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append('%s (%s:%d)' % (code.co_name,
+                                                  os.path.basename(code.co_filename),
+                                                  code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(frames))] += 1
+
+
+PROFILER = SamplingProfiler()  # of this process, see Metrics.publish
+PROFILER.toggle(profiling_enabled())
+
+
+def _after_fork():
+    # threads don't survive a fork (gunicorn --preload): a worker starts its
+    # own profiler and publishes its own snapshot
+    global PROFILER
+    PROFILER = SamplingProfiler()
+    PROFILER.toggle(profiling_enabled())
+    REGISTRY._last_snapshot = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,144 @@
+"""On-disk cache of parsed uploads, keyed by a hash of the uploaded file.
+
+Staff re-upload the same export all the time, so the typed line items frame
+that read_orders produces is saved under the hash of the upload, and an
+identical upload loads it back instead of parsing the CSV again. Frames are
+written as Feather files when pyarrow is installed and as pickles otherwise.
+The cache is bounded by the total size of its files and drops the least
+recently used ones first. It is shared by all workers: an upload that is
+being parsed by one worker is waited for, not parsed again, by the others.
+"""
+import os
+import threading
+
+import pandas as pd
+
+from ingest import read_orders, upload_hash
+from metrics import stage
+from sharedcache import cache_dir as shared_cache_dir, file_lock, private_dir
+
+try:
+    import pyarrow  # noqa: F401 (needed by pd.to_feather/read_feather)
+    HAVE_FEATHER = True
+except ImportError:
+    HAVE_FEATHER = False
+
+DEFAULT_CACHE_NAME = 'wea-parsed'  # directory under sharedcache.CACHE_ROOT
+# Feather has no nullable integer columns, they are stored as floats
+FEATHER_CASTS = {'Shipping Postal Code': 'UInt32'}
+
+
+class ParsedCache(object):
+
+    # Input:  cache_dir: directory of the cached files, created private to
+    #                    this user if missing (files are unpickled, see
+    #                    sharedcache.private_dir), default DEFAULT_CACHE_NAME
+    #                    in the shared cache directory
+    #         max_bytes: upper bound on the total size of the cached files
+    def __init__(self, cache_dir=None, max_bytes=1024**3):
+        if cache_dir is None:
+            cache_dir = shared_cache_dir(DEFAULT_CACHE_NAME)
+        self.cache_dir = private_dir(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'locks'), exist_ok=True)
+
+    # Output: df: line items of the upload (see ingest.read_orders), from
+    #             the cache if the same file was uploaded before
+    # Input:  contents: data URL string from dcc.Upload
+    #         filename: name of the uploaded file
+    #         progress: see ingest.read_orders (not called on cache hits)
+    def read_orders(self, contents, filename, progress=None):
+        key = upload_hash(contents, filename)
+        df = self.load(key)
+        if df is None:
+            # lock files are never deleted, uploads share them by hash prefix
+            with file_lock(os.path.join(self.cache_dir, 'locks', key[:2] + '.lock')):
+                df = self.load(key)  # parsed by another worker meanwhile?
+                if df is None:
+                    df = read_orders(contents, filename, progress)
+                    self.save(key, df)
+        return df
+
+    # Output: the cached dataframe, or None if not cached
+    # Input:  key: upload_hash of the upload
+    def load(self, key):
+        for path, read in [(self._path(key, '.feather'), self._read_feather),
+                           (self._path(key, '.pkl'), pd.read_pickle)]:
+            if os.path.exists(path):
+                try:
+                    with stage('deserialize') as loading:
+                        df = read(path)
+                        loading.rows = len(df)
+                except Exception:  # corrupt/partial file, parse again
+                    continue
+                try:
+                    os.utime(path, None)  # mtime = last access, see evict
+                except OSError:
+                    pass
+                return df
+        return None
+
+    # Saves the dataframe under key (atomically) and evicts old entries
+    # Input:  key: upload_hash of the upload
+    #         df: line items of the upload
+    def save(self, key, df):
+        if HAVE_FEATHER:
+            try:
+                self._write(self._path(key, '.feather'), self._write_feather, df)
+            except Exception:  # column types feather can't store
+                self._write(self._path(key, '.pkl'), pd.to_pickle, df)
+        else:
+            self._write(self._path(key, '.pkl'), pd.to_pickle, df)
+        self.evict()
+
+    # Removes the least recently used files until the cache fits max_bytes
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(('.feather', '.pkl')):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def _write(self, path, write, df):
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            write(df, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def _write_feather(df, path):
+        df = df.reset_index(drop=True)
+        for col in FEATHER_CASTS:
+            if col in df:
+                df[col] = df[col].astype('float64')
+        df.to_feather(path)
+
+    @staticmethod
+    def _read_feather(path):
+        df = pd.read_feather(path)
+        for col, dtype in FEATHER_CASTS.items():
+            if col in df:
+                df[col] = df[col].astype(dtype)
+        return df
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
@@ -0,0 +1,164 @@
+"""Compact encoding of large figures for the browser.
+
+Dash sends figures as plain JSON: every number of a trace as a decimal
+(often with float noise such as 123.45000000000002) and every category or
+date label once per point. pack_figure rewrites the long arrays of a figure
+as
+
+  {'__packed__': 'array', 'dtype': 'u2', 'b64': ..., 'divisor': 100}
+      little-endian typed array, base64 encoded; dollar amounts are sent as
+      integer cents (divisor) and counts as the smallest integer type
+  {'__packed__': 'dates', 'days': <packed array>}
+      dates (without time of day) as days since 1970-01-01
+  {'__packed__': 'digits', 'numbers': <packed array>}
+      strings of digits (e.g. zip codes) as numbers
+  {'__packed__': 'labels', 'codes': <packed array>}
+      other strings as codes into the 'labels' list of the packed figure,
+      which holds every distinct string of all its traces once (-1 = null)
+  {'__packed__': 'rows', 'columns': [...]}
+      2-D arrays such as customdata, packed column by column
+
+The plotly.js bundled with Dash 1.0 cannot read typed arrays from JSON, so
+packed figures are put in a dcc.Store and unpacked into typed arrays in the
+browser by assets/figures.js (window.dash_clientside.figures.unpack).
+"""
+import base64
+import datetime
+import re
+
+import numpy as np
+import pandas as pd
+
+from metrics import timed
+
+MIN_LENGTH = 16  # shorter arrays are sent as is
+INT_TYPES = ['u1', 'i1', 'u2', 'i2', 'i4', 'u4']
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+DIGITS = re.compile(r'^(0|[1-9]\d{0,8})$')  # no leading zeros, fits in u4
+
+
+# Output: dict of the figure's data and layout with long arrays packed, and
+#         the labels table of its strings
+# Input:  figure: Plotly figure (or figure dict)
+#         float32: attribute names whose fractional values can be sent as
+#                  32 bit floats (e.g. map coordinates)
+@timed('serialize')
+def pack_figure(figure, float32=('lat', 'lon')):
+    if hasattr(figure, 'to_dict'):
+        figure = figure.to_dict()
+    labels = {}  # label -> code, shared by all traces
+    data = [pack_attributes(trace, labels, float32) for trace in figure.get('data', [])]
+    return {'data': data,
+            'layout': figure.get('layout', {}),
+            'labels': sorted(labels, key=labels.get)}
+
+
+# Output: dict of trace attributes with the long arrays packed (recursive)
+# Input:  attributes: dict of trace attributes
+#         labels: dict of label -> code, new strings are added to it
+#         float32: see pack_figure
+def pack_attributes(attributes, labels, float32=()):
+    packed = {}
+    for name, value in attributes.items():
+        if isinstance(value, dict):
+            packed[name] = pack_attributes(value, labels, float32)
+        elif isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)) \
+                and len(value) >= MIN_LENGTH:
+            packed[name] = pack_array(value, labels, name in float32)
+        else:
+            packed[name] = value
+    return packed
+
+
+# Output: packed array (see module docstring), or the values unchanged if
+#         they are of a kind that isn't packed (e.g. mixed types)
+# Input:  values: 1-D or 2-D array-like
+#         labels: dict of label -> code, new strings are added to it
+#         float32: True if fractional values may be sent as 32 bit floats
+def pack_array(values, labels, float32=False):
+    array = np.asarray(values)
+    if array.ndim == 2:
+        return {'__packed__': 'rows',
+                'columns': [pack_array(array[:, i], labels, float32)
+                            for i in range(array.shape[1])]}
+    if array.ndim != 1:
+        return values
+    if array.dtype.kind in 'iuf':
+        return pack_numbers(array, float32)
+    if array.dtype.kind == 'M':
+        return pack_dates(array, labels)
+    if array.dtype.kind in 'OU':
+        if all(isinstance(v, (datetime.date, np.datetime64)) for v in array):
+            return pack_dates(array, labels)
+        if all(isinstance(v, str) for v in array):
+            uniques = pd.unique(array)
+            if all(ISO_DATE.match(v) for v in uniques):
+                return pack_dates(pd.to_datetime(array, format='%Y-%m-%d'), labels)
+            if all(DIGITS.match(v) for v in uniques):
+                return {'__packed__': 'digits',
+                        'numbers': pack_integers(array.astype(np.int64))}
+        if all(isinstance(v, str) or v is None or v != v for v in array):
+            return pack_labels(array, labels)
+    return values
+
+
+# Output: packed typed array of the numbers: integers in the smallest
+#         integer type, cent amounts as integer cents, others as floats
+def pack_numbers(array, float32=False):
+    if array.dtype.kind in 'iu':
+        return pack_integers(array)
+    array = array.astype(np.float64)
+    if np.isfinite(array).all():
+        for divisor in (1, 100):
+            scaled = np.round(array * divisor)
+            # absolute tolerance, far below half a cent: float32 money
+            # (see schema.py) is off its cents by float noise only, while a
+            # relative one would round large float64 sums to whole dollars
+            if np.allclose(scaled / divisor, array, rtol=0, atol=1e-4) \
+                    and np.abs(scaled).max() < 2 ** 31:
+                packed = pack_integers(scaled.astype(np.int64))
+                if divisor != 1:
+                    packed['divisor'] = divisor
+                return packed
+    return typed_array(array, 'f4' if float32 else 'f8')
+
+
+# Output: packed typed array in the smallest integer type holding the values
+def pack_integers(array):
+    lo, hi = (int(array.min()), int(array.max())) if len(array) else (0, 0)
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return typed_array(array, dtype)
+    return typed_array(array, 'f8')
+
+
+# Output: {'__packed__': 'array', 'dtype': dtype, 'b64': ...}
+def typed_array(array, dtype):
+    data = np.ascontiguousarray(array, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'__packed__': 'array', 'dtype': dtype,
+            'b64': base64.b64encode(data.tobytes()).decode('ascii')}
+
+
+# Output: codes of the strings in the figure's labels table
+# Input:  values: 1-D array of strings (None/NaN for missing)
+#         labels: dict of label -> code, new strings are added to it
+def pack_labels(values, labels):
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    for label in uniques:
+        labels.setdefault(str(label), len(labels))
+    table = np.array([labels[str(label)] for label in uniques] + [-1])
+    return {'__packed__': 'labels', 'codes': pack_integers(table[codes])}
+
+
+# Output: packed days since epoch, or ISO date-time labels if the dates
+#         have a time of day or are missing
+# Input:  values: 1-D array of dates
+#         labels: dict of label -> code, new strings are added to it
+def pack_dates(values, labels):
+    dates = pd.DatetimeIndex(values)
+    if dates.hasnans or not (dates == dates.normalize()).all():
+        strings = dates.strftime('%Y-%m-%dT%H:%M:%S')
+        return pack_labels(np.asarray(strings, dtype=object), labels)
+    days = dates.values.astype('datetime64[D]').astype(np.int64)
+    return {'__packed__': 'dates', 'days': pack_integers(days)}
@@ -0,0 +1,71 @@
+"""Typed column schema for the canonical orders frame.
+
+Applied once at ingestion so that every later groupby hashes small integer
+codes instead of Python strings, and so a stored dataset takes a fraction of
+the memory of the raw object-dtype frame.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Version of the parsed frame (parsing + column types), part of the key of
+# cached uploads (see ingest.upload_hash): bump it whenever either changes
+SCHEMA_VERSION = 3
+# Repeated strings, stored as pandas categoricals (with sorted categories)
+CATEGORY_COLUMNS = ['Product Name', 'Coupon',
+                    'Shipping First Name', 'Shipping Last Name',
+                    'Shipping Email', 'Shipping City', 'Shipping Region']
+# Dollar amounts; float32 keeps cents exact for single line items/orders,
+# sums should be done in float64 (see as_dollars)
+MONEY_COLUMNS = ['Subtotal', 'Shipping Price', 'Sales ($)']
+
+
+# Output: df: same dataframe with compact column types
+# Input:  df: normalized chunk of line items (see ingest.normalize_orders)
+def apply_schema(df):
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype('category')
+    for col in MONEY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype(np.float32)
+    df['Order #'] = pd.to_numeric(df['Order #'], downcast='unsigned')
+    df['Product Quantity'] = pd.to_numeric(df['Product Quantity'].fillna(0),
+                                           downcast='unsigned')
+    # 5 digit US zip codes; missing on all but the first line of an order.
+    # Read as text: ZIP+4 ('02134-1234') keeps its first 5 digits, codes that
+    # aren't ZIP or ZIP+4 (foreign ones, typos) become missing. Codes from
+    # numeric cells (Excel uploads) may have lost leading zeros or gained '.0'
+    zips = df['Shipping Postal Code'].astype(str).str.strip().str.extract(
+        r'^(\d{1,5})(?:\.0+|-\d{4})?$', expand=False)
+    df['Shipping Postal Code'] = pd.to_numeric(zips, errors='coerce').astype('UInt32')
+    return df
+
+
+# Output: df: single dataframe with categoricals merged across chunks
+# Input:  chunks: list of dataframes that went through apply_schema
+def concat_chunks(chunks):
+    merged = {}
+    for col in CATEGORY_COLUMNS:
+        if col in chunks[0]:
+            merged[col] = union_categoricals([c[col] for c in chunks],
+                                             sort_categories=True)
+            for c in chunks:
+                del c[col]
+    df = pd.concat(chunks, ignore_index=True)
+    for col, values in merged.items():
+        df[col] = values
+    return df
+
+
+# Output: dict of {column: {code: label}} for every categorical column
+# Input:  df: dataframe that went through apply_schema
+def label_maps(df):
+    return {col: dict(enumerate(df[col].cat.categories))
+            for col in CATEGORY_COLUMNS if col in df}
+
+
+# Output: float64 copy of money values, safe to sum and round for display
+# Input:  values: series/array of float32 money values
+def as_dollars(values):
+    return values.astype(np.float64)
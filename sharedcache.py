@@ -0,0 +1,203 @@
+"""Cache backends shared by all worker processes.
+
+gunicorn runs several workers, and a request can land on any of them, so
+everything a later request needs (datasets, filter windows, built figures)
+is kept in a backend that every worker sees:
+
+  FileBackend   - one file per key in a local directory (the default).
+                  Writes are atomic (temporary file + rename) and lock() is
+                  an exclusive file lock, so one worker builds while the
+                  others wait and then read its result.
+  RedisBackend  - a Redis (or Redis-compatible) server, for deployments
+                  with several hosts. Needs the redis package.
+
+Keys are strings, values are bytes. Set WEA_CACHE_URL to redis://... to use
+Redis, see backend_from_env.
+
+Cached values are unpickled, so whoever can write to the cache directories
+can run code in the workers. They live under CACHE_ROOT, a directory private
+to the user running the app: WEA_CACHE_DIR if set, otherwise wea-cache-<uid>
+in the system temp directory. It is created with mode 0700, and refused
+(PermissionError) if it already exists with another owner or open to others.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only work between threads
+    fcntl = None
+
+CACHE_ROOT = os.environ.get('WEA_CACHE_DIR') or os.path.join(
+    tempfile.gettempdir(), 'wea-cache-%s' % (os.getuid() if hasattr(os, 'getuid') else 'user'))
+LOCK_STRIPES = 256  # lock files per FileBackend, keys with the same hash share one
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+# Context manager holding an exclusive lock on path (created if missing),
+# between processes (flock) and between threads of this process
+@contextmanager
+def file_lock(path):
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Output: path of the cache directory name under CACHE_ROOT, both created
+#         private to this user if missing (see private_dir)
+def cache_dir(name):
+    private_dir(CACHE_ROOT)
+    return private_dir(os.path.join(CACHE_ROOT, name))
+
+
+# Output: path, a directory created with mode 0700 if missing
+# Raises: PermissionError if it exists but belongs to another user or is
+#         accessible to others
+def private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, 'getuid'):  # Windows: the temp directory is per user
+        return path
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError('cache directory %s must belong to uid %d and not be '
+                              'accessible to others (mode 0700)' % (path, os.getuid()))
+    return path
+
+
+class FileBackend(object):
+
+    # Input:  directory: where the values are stored, created private to
+    #                    this user if missing (see private_dir)
+    def __init__(self, directory):
+        self.directory = private_dir(directory)
+        os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+
+    # Output: bytes stored under key, or None if unknown
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                value = f.read()
+        except (IOError, OSError):
+            return None
+        self.touch(key)  # mtime = last access, see evict
+        return value
+
+    # Marks key as accessed (keeps it from expiring)
+    def touch(self, key):
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+
+    # Stores value (bytes) under key, replacing any previous value atomically
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(value)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # Context manager: exclusive lock on key across workers. Lock files are
+    # never deleted (removing a file someone waits on breaks flock), so keys
+    # share a fixed set of them.
+    def lock(self, key):
+        stripe = int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % LOCK_STRIPES
+        return file_lock(os.path.join(self.directory, 'locks', '%03d.lock' % stripe))
+
+    # Removes values not accessed within max_age seconds, then the least
+    # recently used ones until the values fit in max_bytes
+    def evict(self, max_age=None, max_bytes=None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.val'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - max_age if max_age is not None else None
+        for mtime, size, path in entries:
+            expired = cutoff is not None and mtime < cutoff
+            too_big = max_bytes is not None and total > max_bytes
+            if not (expired or too_big):
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _path(self, key):
+        # keys come back from the browser, never use them as paths directly
+        safe = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, safe + '.val')
+
+
+class RedisBackend(object):
+
+    # Input:  url: redis://host:port/db of the server
+    #         namespace: prefix of every key (one per kind of value)
+    #         ttl: seconds a value is kept after its last access
+    def __init__(self, url, namespace, ttl=60*60):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.namespace = namespace + ':'
+        self.ttl = ttl
+
+    # Output: bytes stored under key, or None if unknown
+    def get(self, key):
+        value = self.client.get(self.namespace + key)
+        if value is not None:
+            self.touch(key)
+        return value
+
+    # Marks key as accessed (keeps it from expiring)
+    def touch(self, key):
+        self.client.expire(self.namespace + key, self.ttl)
+
+    # Stores value (bytes) under key
+    def set(self, key, value):
+        self.client.set(self.namespace + key, value, ex=self.ttl)
+
+    # Context manager: exclusive lock on key across workers and hosts
+    def lock(self, key):
+        return self.client.lock(self.namespace + 'lock:' + key, timeout=10*60)
+
+    # Redis expires values itself (ttl, and maxmemory policy for size)
+    def evict(self, max_age=None, max_bytes=None):
+        pass
+
+
+# Output: backend for one kind of cached value: Redis if WEA_CACHE_URL is a
+#         redis:// URL, otherwise files in a subdirectory of CACHE_ROOT
+# Input:  namespace: name of the kind of value (e.g. 'wea-datasets')
+#         ttl: seconds a value is kept after its last access (Redis only,
+#              files are evicted by the caller)
+def backend_from_env(namespace, ttl=60*60):
+    url = os.environ.get('WEA_CACHE_URL', '')
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url, namespace, ttl=ttl)
+    return FileBackend(cache_dir(namespace))
@@ -0,0 +1,114 @@
+"""Warm-up of the heavy initializations done on first use.
+
+The first callbacks of a fresh process would otherwise pay for
+
+  zipcodes  the zip code table (geocode.zip_table), read from the uszipcode
+            SQLite database the very first time on a machine
+  genders   parsing gender_guesser's name dictionary (genders.detector)
+  plotly    Plotly Express, the default template and the validators of the
+            trace types the dashboard draws, all set up by the first figure
+
+warm_up() does all of them once per process. Under gunicorn (see
+gunicorn.conf.py) the app is imported and warmed up in the master, so the
+forked workers start warm and share that memory. Otherwise start() warms up
+in a background thread (python app.py, or the first /ready request).
+
+/ready answers 503 while warming up and 200 once done, with the seconds
+every step took (and the steps that failed, the app still works without
+them, only slower on first use).
+"""
+import json
+import threading
+import time
+
+_status = {'ready': False, 'started': None, 'seconds': {}, 'errors': {}}
+_lock = threading.Lock()   # only held to claim the warm-up, never during it
+_done = threading.Event()
+
+
+def warm_zipcodes():
+    from geocode import zip_table
+    zip_table()
+
+
+def warm_genders():
+    from genders import detector
+    detector()
+
+
+def warm_plotly():
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    df = pd.DataFrame({'Date': ['2019-01-01', '2019-01-02'], 'y': [1.0, 2.0],
+                       'lat': [40.7, 34.1], 'long': [-74.0, -118.2]})
+    figures = [px.bar(df, x='Date', y='y'),
+               px.scatter_geo(df, lat='lat', lon='long', size='y'),
+               go.Figure(go.Table(header=dict(values=['y']), cells=dict(values=[df['y']]))),
+               go.Figure(go.Bar(x=df['y'], y=df['y']))]
+    for fig in figures:
+        fig.to_json()
+
+
+STEPS = [('zipcodes', warm_zipcodes), ('genders', warm_genders),
+         ('plotly', warm_plotly)]
+
+
+# Runs every warm-up step (once per process, later calls wait for the
+# first one) and marks the process ready
+def warm_up():
+    if claim():
+        run_steps()
+    else:
+        _done.wait()
+
+
+# Starts warm_up in a background thread, unless warm or warming up already
+def start():
+    if claim():
+        thread = threading.Thread(target=run_steps, name='wea-warmup')
+        thread.daemon = True
+        thread.start()
+
+
+# Output: True if the caller is the one to run the steps (nobody started yet)
+def claim():
+    with _lock:
+        if _status['started'] is not None:
+            return False
+        _status['started'] = time.time()
+        return True
+
+
+def run_steps():
+    for name, step in STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:  # e.g. no network for the uszipcode DB
+            _status['errors'] = dict(_status['errors'], **{name: repr(e)})
+        seconds = round(time.perf_counter() - start, 6)
+        # replaced rather than updated, status() reads without the lock
+        _status['seconds'] = dict(_status['seconds'], **{name: seconds})
+    _status['ready'] = True
+    _done.set()
+
+
+# Output: dict of ready (bool), seconds per finished step, errors per step
+def status():
+    return {'ready': _status['ready'], 'seconds': _status['seconds'],
+            'errors': _status['errors']}
+
+
+# Adds /ready to the Flask server: 200 when warm, 503 while warming up (the
+# first request starts the warm-up if nothing did)
+# Input:  server: Flask app of the Dash app
+def add_ready_endpoint(server):
+    from flask import Response
+
+    @server.route('/ready')
+    def ready():
+        start()
+        current = status()
+        return Response(json.dumps(current), status=200 if current['ready'] else 503,
+                        mimetype='application/json')